@@ -2,10 +2,16 @@
 # -*- coding: UTF-8 -*-
 
 import os
+import sys
+import json
+import heapq
 import struct
 import time
 import select
 import socket
+import argparse
+import ipaddress
+from inet_checksum import checksum, update as update_checksum   # 与Traceroute共用的校验和实现
 
 # ICMP消息类型常量
 ICMP_ECHO_REQUEST = 8  # 回显请求
@@ -13,41 +19,30 @@ ICMP_ECHO_REPLY = 0  # 回显应答
 ICMP_UNREACHABLE_TYPE = 3  # 不可达类型
 ICMP_HOST_UNREACHABLE_CODE = 1  # 主机不可达代码
 ICMP_NETWORK_UNREACHABLE_CODE = 0  # 网络不可达代码
+ICMP_TIME_EXCEEDED_TYPE = 11  # 超时（TTL耗尽）类型
 
-# ICMP包格式常量，无符号字节，无符号短整数，有符号短整数
-ICMP_PACKET_FORMAT = '!bbHHh'  # 格式为：类型、代码、校验和、ID、序列号
+# ICMP包格式常量，无符号字节，无符号短整数，无符号短整数
+ICMP_PACKET_FORMAT = '!bbHHH'  # 格式为：类型、代码、校验和、ID、序列号
 
 # 全局变量：ICMP包ID和序列号
 icmp_id = os.getpid() & 0xFFFF  # 使用进程ID作为ICMP包ID，并限制为16位
 icmp_sequence = 0  # ICMP包序列号
 
-def checksum(packet):
-    """
-    计算并返回给定数据包的校验和。
-    """
-    # 初始化校验和为零
-    csum = 0
-    count_to = (len(packet) // 2) * 2
-    count = 0
-
-    # 两字节一组累加数据包
-    while count < count_to:
-        this_val = packet[count+1] * 256 + packet[count]
-        csum += this_val
-        csum &= 0xffffffff  # 截断为32位
-        count += 2
-
-    # 如果有剩余字节，加入校验和
-    if count_to < len(packet):
-        csum += packet[len(packet) - 1]
-        csum &= 0xffffffff  # 截断为32位
-
-    # 校验和计算的最后步骤
-    csum = (csum >> 16) + (csum & 0xffff)  # 高16位加低16位
-    csum += (csum >> 16)  # 加上进位（如果有）
-    answer = ~csum & 0xffff  # 取反并截断为16位
-    answer = answer >> 8 | (answer << 8 & 0xff00)  # 字节交换
-    return answer
+# 多主机ping引擎的默认参数
+MULTI_TIMEOUT = 1.0        # 每个探测包的超时时间（秒）
+MULTI_PERIOD = 1.0         # 同一个目标两次探测之间的间隔（秒）
+MULTI_INTERVAL = 0.001     # 相邻两个探测包（可以是不同目标）之间的最小间隔（秒），避免瞬间打满网络和接收缓冲区
+MULTI_RCVBUF = 1 << 20     # 接收缓冲区大小，扫描整个网段时应答会集中到达
+MULTI_MAX_TARGETS = 65536  # 目标个数上限，展开过大的网段时报错
+
+# 高频精确计时模式
+PRECISE_COUNT = 100        # 默认探测次数，0表示一直发到Ctrl-C或 -w 指定的时间
+PRECISE_PERCENTILES = (0.5, 0.9, 0.99)   # 流式估计的RTT分位数
+# 内核接收时间戳（struct timespec，CLOCK_REALTIME）。Python没有导出这个常量，Linux上的值是35
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35 if sys.platform.startswith('linux') else None)
+TIMESPEC_FORMAT = '@ll'    # 秒、纳秒，本机字节序和long长度
+PRECISE_PAYLOAD = 56       # 默认载荷字节数（前8字节是发送时间），与系统ping相同
+INCREMENTAL_CHECKSUM_MIN = 512   # 报文达到这个长度时用模板加增量更新计算校验和，更短时整包重算更快
 
 def send_one_ping(icmp_socket, destination_addr, icmp_id, icmp_sequence):
     """
@@ -57,8 +52,8 @@ def send_one_ping(icmp_socket, destination_addr, icmp_id, icmp_sequence):
     # 将数据按照指定的格式（format）打包成二进制数据。在这里，它被用来打包 ICMP  头部。
     icmp_header = struct.pack(ICMP_PACKET_FORMAT, ICMP_ECHO_REQUEST, 0, 0, icmp_id, icmp_sequence)
 
-    # 载荷为当前时间
-    payload = struct.pack('!d', time.time())
+    # 载荷为发送时刻的单调时钟读数（同一进程内比较，不受系统时间调整影响）
+    payload = struct.pack('!d', time.perf_counter())
 
     # 计算头和负载的校验和
     icmp_checksum = checksum(icmp_header + payload)
@@ -91,8 +86,8 @@ def receive_one_ping(icmp_socket, icmp_id, timeout):
     if not ready[0]:
         return -1
 
-    # 接收到包，记录当前时间
-    time_received = time.time()
+    # 接收到包，记录当前时间（与载荷里的时间同一个单调时钟）
+    time_received = time.perf_counter()
     # 接收包
     rec_packet, _ = icmp_socket.recvfrom(1024) # 忽略IP 地址和端口号
 
@@ -146,8 +141,8 @@ def ping(host, timeout=1000, count=4):
     print(f"向 {host} 发送 {count} 次ICMP请求：")
     # 初始化发送、丢失和接收的包数
     sent, lost, received = 0, 0, 0
-    # 延迟列表
-    delays = []
+    # 延迟统计（常数内存，不保存每个延迟）
+    delays = RunningStats()
 
     for _ in range(count):
         # 执行一次ping
@@ -157,7 +152,7 @@ def ping(host, timeout=1000, count=4):
         if delay > 0:
             # 包被接收，记录延迟
             received += 1
-            delays.append(delay)
+            delays.add(delay)
             print(f"从 {dest_addr} 收到：icmp_seq={icmp_sequence} 时间={delay*1000:.2f} ms")
         else:
             # 包丢失
@@ -170,16 +165,662 @@ def ping(host, timeout=1000, count=4):
     # 打印统计信息
     if received > 0:
         # 计算最小、最大和平均延迟
-        min_delay = min(delays)
-        max_delay = max(delays)
-        avg_delay = sum(delays) / received
+        min_delay = delays.min
+        max_delay = delays.max
+        avg_delay = delays.mean
         print(f"--- {host} ping 统计信息 ---")
-        print(f"{sent} 包发送, {received} 接收, {100 * lost / sent:.1f}% 丢包, 总时间 {sum(delays)*1000:.2f}ms")
+        print(f"{sent} 包发送, {received} 接收, {100 * lost / sent:.1f}% 丢包, 总时间 {delays.total*1000:.2f}ms")
         print(f"rtt 最小/平均/最大 = {min_delay*1000:.3f}/{avg_delay*1000:.3f}/{max_delay*1000:.3f} ms")
     else:
         print(f"--- {host} ping 统计信息 ---")
         print(f"{sent} 包发送, {received} 接收, 100% 丢包")
 
+class P2Quantile:
+    """
+    用P²算法（Jain & Chlamtac 1985）流式估计一个分位数：只保存5个标记点，内存与样本数无关。
+    """
+    def __init__(self, p):
+        self.p = p
+        self.initial = []     # 前5个样本，第6个样本到达时初始化标记点；在此之前直接按秩取值
+        self.heights = None   # 5个标记点的高度（估计值）
+        self.positions = None
+        self.desired = None
+        self.increments = (0, p / 2, p, (1 + p) / 2, 1)
+
+    def add(self, x):
+        if self.heights is None:
+            if len(self.initial) < 5:
+                self.initial.append(x)
+                return
+            self.heights = sorted(self.initial)
+            self.positions = [0, 1, 2, 3, 4]
+            self.desired = [0, 2 * self.p, 4 * self.p, 2 + 2 * self.p, 4]
+        q, n = self.heights, self.positions
+        # 找到x所在的区间，必要时扩展最小/最大标记
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        # 中间三个标记偏离期望位置超过1时移动一格，高度用抛物线插值，越界时退回线性插值
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        if self.heights is not None:
+            return self.heights[2]
+        if not self.initial:
+            return None
+        ordered = sorted(self.initial)   # 样本不超过5个时直接取最近秩
+        return ordered[min(len(ordered) - 1, int(round(self.p * (len(ordered) - 1))))]
+
+class RunningStats:
+    """
+    RTT的流式统计：最小/最大/平均、标准差（mdev，Welford算法）、RFC 3550抖动和若干分位数，
+    每个样本O(1)时间、整体常数内存。
+    """
+    def __init__(self, percentiles=PRECISE_PERCENTILES):
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0           # 与均值之差的平方和
+        self.min = None
+        self.max = None
+        self.jitter = 0.0       # 相邻两个RTT之差的平滑平均，J += (|D| - J) / 16
+        self.last = None
+        self.quantiles = [P2Quantile(p) for p in percentiles]
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        if self.last is not None:
+            self.jitter += (abs(x - self.last) - self.jitter) / 16
+        self.last = x
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    @property
+    def mdev(self):
+        # 与ping的mdev相同：总体标准差
+        return (self.m2 / self.count) ** 0.5 if self.count else 0.0
+
+    def summary(self):
+        """
+        返回以毫秒为单位、可以写成JSON的统计字典。
+        """
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        result = {
+            'rtt_min_ms': ms(self.min),
+            'rtt_avg_ms': ms(self.mean) if self.count else None,
+            'rtt_max_ms': ms(self.max),
+            'rtt_mdev_ms': ms(self.mdev) if self.count else None,
+            'jitter_ms': ms(self.jitter) if self.count > 1 else None,
+        }
+        for quantile in self.quantiles:
+            result['rtt_p%g_ms' % (quantile.p * 100)] = ms(quantile.value())
+        return result
+
+def parse_icmp(packet):
+    """
+    解析原始套接字收到的IP包，返回 (类型, 代码, ID, 序列号, 被引用包的目的地址)。
+    回显应答的ID和序列号在ICMP头里；不可达和超时报文的ID和序列号在它引用的原始包里，
+    同时返回原始包的目的地址。不是IPv4/ICMP或太短的包返回None。
+    """
+    if len(packet) < 20 or packet[0] >> 4 != 4:
+        return None
+    header_length = (packet[0] & 0x0f) * 4   # IP头长度，带选项时不是20字节
+    if len(packet) < header_length + 8:
+        return None
+    type_, code, _, packet_id, sequence = struct.unpack(ICMP_PACKET_FORMAT, packet[header_length:header_length + 8])
+    if type_ in (ICMP_UNREACHABLE_TYPE, ICMP_TIME_EXCEEDED_TYPE):
+        inner = packet[header_length + 8:]   # 被引用的原始IP头加上原始ICMP头的前8个字节
+        if len(inner) < 20:
+            return None
+        inner_length = (inner[0] & 0x0f) * 4
+        if inner[9] != socket.IPPROTO_ICMP or len(inner) < inner_length + 8:
+            return None
+        _, _, _, packet_id, sequence = struct.unpack(ICMP_PACKET_FORMAT, inner[inner_length:inner_length + 8])
+        return type_, code, packet_id, sequence, socket.inet_ntoa(inner[16:20])
+    return type_, code, packet_id, sequence, None
+
+class PingTarget:
+    """
+    一个被探测的目标及其统计：发送数、接收数、RTT最小/最大/总和、不可达次数。
+    """
+    def __init__(self, host, address):
+        self.host = host
+        self.address = address
+        self.sent = 0
+        self.received = 0
+        self.unreachable = 0      # 收到不可达或超时报文的探测数
+        self.duplicates = 0       # 重复或超时后才到达的应答
+        self.errors = 0           # 发送失败的次数
+        self.rtt = RunningStats()
+        self.last_error = None
+
+    def add_rtt(self, rtt):
+        self.received += 1
+        self.rtt.add(rtt)
+
+    def summary(self):
+        """
+        返回可以直接写成JSON的统计字典，时间单位为毫秒。
+        """
+        result = {
+            'host': self.host,
+            'address': self.address,
+            'sent': self.sent,
+            'received': self.received,
+            'loss': round(100.0 * (self.sent - self.received) / self.sent, 1) if self.sent else None,
+        }
+        result.update(self.rtt.summary())
+        result.update({
+            'unreachable': self.unreachable,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        })
+        return result
+
+class Probe:
+    """
+    一个已发出、等待应答的回显请求。
+    """
+    __slots__ = ('target', 'sequence', 'sent_at', 'done')
+
+    def __init__(self, target, sequence, sent_at):
+        self.target = target
+        self.sequence = sequence
+        self.sent_at = sent_at
+        self.done = False
+
+class MultiPing:
+    """
+    fping式的多主机ping：所有目标共用一个原始套接字，交错发送回显请求，
+    按ICMP ID、序列号和源地址把应答分配给对应的探测；每个探测的超时和每个目标的下一次发送
+    都放在同一个按时间排序的堆里，所以扫描一个/24网段的时间大约是一次超时，而不是 256 × 次数 秒。
+    """
+    SEND, EXPIRE = 0, 1   # 堆里的两种事件
+
+    def __init__(self, targets, count=1, timeout=MULTI_TIMEOUT, period=MULTI_PERIOD,
+                 interval=MULTI_INTERVAL, on_reply=None):
+        self.targets = targets
+        self.count = count
+        self.timeout = timeout
+        self.period = period
+        self.interval = interval
+        self.on_reply = on_reply      # 回调 on_reply(目标, 序列号, RTT或None, 说明)，用于逐包输出
+        self.identifier = icmp_id
+        self.next_sequence = 0
+        self.outstanding = {}         # 序列号 -> 等待应答的Probe
+        self.events = []              # (时间, 序号, 事件类型, 对象) 的堆
+        self.order = 0                # 堆中时间相同时保持插入顺序
+        self.pending_sends = 0        # 堆里还没执行的发送事件数
+        self.sock = None
+
+    def open_socket(self):
+        icmp_proto = socket.getprotobyname('icmp')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp_proto)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MULTI_RCVBUF)
+        except OSError:
+            pass   # 拿不到更大的缓冲区也能工作，只是大规模扫描时更容易丢应答
+        sock.setblocking(False)
+        return sock
+
+    def schedule(self, when, kind, obj):
+        self.order += 1
+        if kind == self.SEND:
+            self.pending_sends += 1
+        heapq.heappush(self.events, (when, self.order, kind, obj))
+
+    def run(self):
+        """
+        发送全部探测并等待应答或超时，返回目标列表（统计已填好）。
+        """
+        self.sock = self.open_socket()
+        try:
+            start = time.perf_counter()
+            # 第一轮按最小间隔错开，之后每个目标按自己的周期继续，整体仍然保持错开
+            for i, target in enumerate(self.targets):
+                if self.count > 0:
+                    self.schedule(start + i * self.interval, self.SEND, target)
+            # 没有待发送的探测、也没有等待应答的探测时结束，不必等剩下的超时事件
+            while self.pending_sends or self.outstanding:
+                now = time.perf_counter()
+                while self.events and self.events[0][0] <= now:
+                    _, _, kind, obj = heapq.heappop(self.events)
+                    if kind == self.SEND:
+                        self.pending_sends -= 1
+                        self.send_probe(obj)
+                    else:
+                        self.expire(obj)
+                if not (self.pending_sends or self.outstanding):
+                    break
+                wait = max(0.0, self.events[0][0] - time.perf_counter())
+                ready, _, _ = select.select([self.sock], [], [], wait)
+                if ready:
+                    self.drain()
+        finally:
+            self.sock.close()
+            self.sock = None
+        return self.targets
+
+    def send_probe(self, target):
+        # 16位序列号在所有目标间递增，ID和序列号一起唯一确定一个探测
+        now = time.perf_counter()
+        if len(self.outstanding) > 0xFFFF:
+            # 65536个序列号都在等待应答：推迟到最早的探测超时、空出序列号时再发，不计入发送数
+            oldest = next(iter(self.outstanding.values()))
+            self.schedule(max(oldest.sent_at + self.timeout, now + self.interval), self.SEND, target)
+            return
+        for _ in range(0x10000):   # 上面保证至少有一个空闲的序列号，最多找一圈
+            self.next_sequence = (self.next_sequence + 1) & 0xFFFF
+            if self.next_sequence not in self.outstanding:
+                break
+        sequence = self.next_sequence
+        try:
+            send_one_ping(self.sock, target.address, self.identifier, sequence)
+        except BlockingIOError:
+            self.schedule(now + self.interval, self.SEND, target)   # 发送缓冲区满，稍后重试，不计入发送数
+            return
+        except OSError as e:
+            target.sent += 1
+            target.errors += 1
+            target.last_error = e.strerror or str(e)
+            if self.on_reply:
+                self.on_reply(target, sequence, None, target.last_error)
+        else:
+            target.sent += 1
+            probe = Probe(target, sequence, time.perf_counter())
+            self.outstanding[sequence] = probe
+            self.schedule(probe.sent_at + self.timeout, self.EXPIRE, probe)
+        if target.sent < self.count:
+            self.schedule(now + self.period, self.SEND, target)
+
+    def expire(self, probe):
+        if probe.done:
+            return
+        probe.done = True
+        del self.outstanding[probe.sequence]
+        if self.on_reply:
+            self.on_reply(probe.target, probe.sequence, None, '请求超时')
+
+    def drain(self):
+        # 一次把缓冲区里的应答读完，减少select调用
+        while True:
+            try:
+                packet, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            received_at = time.perf_counter()
+            self.handle_packet(packet, address[0], received_at)
+
+    def handle_packet(self, packet, source, received_at):
+        parsed = parse_icmp(packet)
+        if parsed is None:
+            return
+        type_, code, packet_id, sequence, quoted_destination = parsed
+        if packet_id != self.identifier:
+            return   # 别的进程的ping
+        if type_ == ICMP_ECHO_REPLY:
+            probe = self.outstanding.get(sequence)
+            if probe is None or probe.target.address != source:
+                # 超时之后才到达、重复的应答，或者来源地址不对
+                for target in self.targets:
+                    if target.address == source:
+                        target.duplicates += 1
+                        break
+                return
+            probe.done = True
+            del self.outstanding[sequence]
+            rtt = received_at - probe.sent_at
+            probe.target.add_rtt(rtt)
+            if self.on_reply:
+                self.on_reply(probe.target, sequence, rtt, None)
+        elif type_ in (ICMP_UNREACHABLE_TYPE, ICMP_TIME_EXCEEDED_TYPE):
+            probe = self.outstanding.get(sequence)
+            if probe is None or probe.target.address != quoted_destination:
+                return
+            probe.done = True
+            del self.outstanding[sequence]
+            probe.target.unreachable += 1
+            if type_ == ICMP_UNREACHABLE_TYPE:
+                reason = '主机不可达' if code == ICMP_HOST_UNREACHABLE_CODE else \
+                         '网络不可达' if code == ICMP_NETWORK_UNREACHABLE_CODE else '目标不可达(代码%d)' % code
+            else:
+                reason = 'TTL超时'
+            probe.target.last_error = '%s (来自 %s)' % (reason, source)
+            if self.on_reply:
+                self.on_reply(probe.target, sequence, None, probe.target.last_error)
+        # 其他类型（包括发往本机时原始套接字收到的自己的回显请求）忽略
+
+def expand_targets(specs):
+    """
+    把主机名、IP地址和CIDR网段（如 192.168.1.0/24）展开成PingTarget列表，
+    返回 (目标列表, 无法解析的主机列表)，后者也是PingTarget，地址为None。
+    """
+    targets, unresolved = [], []
+    for spec in specs:
+        if '/' in spec:
+            network = ipaddress.IPv4Network(spec, strict=False)
+            hosts = list(network.hosts()) if network.num_addresses > 2 else list(network)
+            if len(targets) + len(hosts) > MULTI_MAX_TARGETS:
+                raise ValueError("太多目标：%s 展开后超过 %d 个地址" % (spec, MULTI_MAX_TARGETS))
+            targets.extend(PingTarget(str(address), str(address)) for address in hosts)
+            continue
+        try:
+            targets.append(PingTarget(spec, socket.gethostbyname(spec)))
+        except OSError:
+            target = PingTarget(spec, None)
+            target.last_error = '无法解析主机名'
+            unresolved.append(target)
+    return targets, unresolved
+
+def multi_ping(specs, count=1, timeout=MULTI_TIMEOUT, period=MULTI_PERIOD, interval=MULTI_INTERVAL,
+               verbose=False, json_file=None):
+    """
+    同时ping多个主机，打印每个主机的统计；json_file不为空时每个主机写一行JSON（'-'表示标准输出）。
+    """
+    targets, unresolved = expand_targets(specs)
+
+    def report(target, sequence, rtt, error):
+        if rtt is not None:
+            print(f"{target.host} : icmp_seq={sequence} 时间={rtt*1000:.2f} ms")
+        else:
+            print(f"{target.host} : icmp_seq={sequence} {error}")
+
+    begin = time.perf_counter()
+    MultiPing(targets, count, timeout, period, interval, report if verbose else None).run()
+    elapsed = time.perf_counter() - begin
+
+    summaries = [target.summary() for target in targets + unresolved]
+    if json_file:
+        out = sys.stdout if json_file == '-' else open(json_file, 'w', encoding='utf-8')
+        try:
+            for summary in summaries:
+                out.write(json.dumps(summary, ensure_ascii=False) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    if json_file != '-':
+        for summary in summaries:
+            line = f"{summary['host']:<20} : 发送/接收/丢包 = {summary['sent']}/{summary['received']}/"
+            line += f"{summary['loss']}%" if summary['loss'] is not None else "-"
+            if summary['received']:
+                line += f", 最小/平均/最大 = {summary['rtt_min_ms']:.3f}/{summary['rtt_avg_ms']:.3f}/{summary['rtt_max_ms']:.3f} ms"
+            elif summary['last_error']:
+                line += f", {summary['last_error']}"
+            print(line)
+        alive = sum(1 for summary in summaries if summary['received'])
+        print(f"--- {len(summaries)} 个目标，{alive} 个有应答，用时 {elapsed:.2f} s ---")
+    return summaries
+
+class PrecisePing:
+    """
+    单目标高频ping：套接字在整个过程中保持打开，按绝对时间表以固定间隔（可以小于1秒）发送，
+    RTT用单调的perf_counter_ns计算；内核支持SO_TIMESTAMPNS时改用内核收包时间戳，
+    去掉Python调度带来的延迟。统计用RunningStats，内存不随探测次数增长。
+    """
+    def __init__(self, address, count=PRECISE_COUNT, interval=MULTI_PERIOD, timeout=MULTI_TIMEOUT,
+                 deadline=None, on_reply=None, size=PRECISE_PAYLOAD):
+        self.address = address
+        self.count = count                       # 0表示不限次数
+        self.interval_ns = int(interval * 1e9)
+        self.timeout_ns = int(timeout * 1e9)
+        self.deadline = deadline                 # 最长运行时间（秒），None表示不限
+        self.on_reply = on_reply                 # 回调 on_reply(序列号, RTT或None)
+        self.identifier = icmp_id
+        self.sequence = 0
+        self.outstanding = {}                    # 序列号 -> (perf_counter_ns, time_ns)，按发送顺序排列
+        self.sent = 0
+        self.received = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.kernel_timestamps = False           # 套接字是否开启了SO_TIMESTAMPNS
+        self.kernel_samples = 0                  # 实际使用内核时间戳的样本数
+        self.stats = RunningStats()
+        self.elapsed = 0.0
+        self.sock = None
+        # 报文模板：序列号和时间戳为0，其余内容固定；每次发送只替换这两个字段
+        header = struct.pack(ICMP_PACKET_FORMAT, ICMP_ECHO_REQUEST, 0, 0, self.identifier, 0)
+        self.template = header + bytes(max(8, size))
+        self.template_checksum = checksum(self.template)
+
+    def open_socket(self):
+        icmp_proto = socket.getprotobyname('icmp')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp_proto)
+        if SO_TIMESTAMPNS is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                self.kernel_timestamps = True
+            except OSError:
+                pass   # 不支持时退回用户态的perf_counter_ns
+        sock.setblocking(False)
+        return sock
+
+    def run(self):
+        self.sock = self.open_socket()
+        start = time.perf_counter_ns()
+        stop_at = start + int(self.deadline * 1e9) if self.deadline else None
+        next_send = start
+        sending = True
+        try:
+            while sending or self.outstanding:
+                now = time.perf_counter_ns()
+                if sending and (stop_at is not None and now >= stop_at or self.count and self.sent >= self.count):
+                    sending = False
+                if sending and now >= next_send:
+                    self.send_probe()
+                    # 按绝对时间表前进，不累积误差；落后太多（例如进程被挂起）时不补发
+                    next_send += self.interval_ns
+                    if next_send < now:
+                        next_send = now
+                    continue
+                self.expire(now)
+                if not (sending or self.outstanding):
+                    break
+                wake = next_send if sending else None
+                if self.outstanding:
+                    oldest = next(iter(self.outstanding.values()))[0] + self.timeout_ns
+                    wake = oldest if wake is None else min(wake, oldest)
+                ready, _, _ = select.select([self.sock], [], [], max(0, wake - now) / 1e9)
+                if ready:
+                    self.drain()
+        except KeyboardInterrupt:
+            pass   # Ctrl-C结束发送，输出已有的统计
+        finally:
+            self.elapsed = (time.perf_counter_ns() - start) / 1e9
+            self.sock.close()
+            self.sock = None
+        return self
+
+    def send_probe(self):
+        self.sequence = (self.sequence + 1) & 0xFFFF   # 序列号是无符号短整数
+        packet = bytearray(self.template)
+        struct.pack_into('!H', packet, 6, self.sequence)
+        struct.pack_into('!Q', packet, 8, time.perf_counter_ns())
+        if len(packet) >= INCREMENTAL_CHECKSUM_MIN:
+            # 按RFC 1624只根据变化的10个字节调整模板的校验和，代价与报文长度无关
+            csum = update_checksum(self.template_checksum, 6, self.template[6:16], packet[6:16])
+        else:
+            csum = checksum(packet)
+        struct.pack_into('!H', packet, 2, csum)
+        self.sent += 1
+        # 包已经构造好，紧挨着sendto记录两个时钟：单调时钟用于用户态RTT，系统时钟与内核收包时间戳比较
+        sent_ns, sent_wall_ns = time.perf_counter_ns(), time.time_ns()
+        try:
+            self.sock.sendto(packet, (self.address, 1))
+        except OSError as e:
+            self.errors += 1
+            if self.on_reply:
+                self.on_reply(self.sequence, None, e.strerror or str(e))
+            return
+        self.outstanding.pop(self.sequence, None)   # 序列号回绕时丢掉很久以前的记录
+        self.outstanding[self.sequence] = (sent_ns, sent_wall_ns)
+
+    def expire(self, now):
+        # outstanding按发送顺序排列，只需检查最前面的
+        while self.outstanding:
+            sequence, (sent_ns, _) = next(iter(self.outstanding.items()))
+            if sent_ns + self.timeout_ns > now:
+                break
+            del self.outstanding[sequence]
+            if self.on_reply:
+                self.on_reply(sequence, None, '请求超时')
+
+    def drain(self):
+        while True:
+            try:
+                packet, ancillary, _, address = self.sock.recvmsg(2048, socket.CMSG_SPACE(16))
+            except (BlockingIOError, InterruptedError):
+                return
+            received_ns = time.perf_counter_ns()
+            kernel_ns = None
+            for level, kind, data in ancillary:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= struct.calcsize(TIMESPEC_FORMAT):
+                    seconds, nanoseconds = struct.unpack_from(TIMESPEC_FORMAT, data)
+                    kernel_ns = seconds * 1000000000 + nanoseconds
+            self.handle_packet(packet, address[0], received_ns, kernel_ns)
+
+    def handle_packet(self, packet, source, received_ns, kernel_ns):
+        parsed = parse_icmp(packet)
+        if parsed is None or source != self.address:
+            return
+        type_, _, packet_id, sequence, _ = parsed
+        if type_ != ICMP_ECHO_REPLY or packet_id != self.identifier:
+            return
+        sent = self.outstanding.pop(sequence, None)
+        if sent is None:
+            self.duplicates += 1   # 重复或超时后才到达
+            return
+        sent_ns, sent_wall_ns = sent
+        rtt_ns = received_ns - sent_ns
+        if kernel_ns is not None:
+            # 内核时间戳基于系统时钟；只有结果合理（为正且不大于用户态测得的值）时才采用，
+            # 这样系统时间在两次读数之间被调整也不会产生错误的RTT
+            kernel_rtt_ns = kernel_ns - sent_wall_ns
+            if 0 < kernel_rtt_ns <= rtt_ns:
+                rtt_ns = kernel_rtt_ns
+                self.kernel_samples += 1
+        rtt = rtt_ns / 1e9
+        self.received += 1
+        self.stats.add(rtt)
+        if self.on_reply:
+            self.on_reply(sequence, rtt, None)
+
+    def summary(self):
+        result = {
+            'host': self.address,
+            'address': self.address,
+            'sent': self.sent,
+            'received': self.received,
+            'loss': round(100.0 * (self.sent - self.received) / self.sent, 1) if self.sent else None,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'elapsed_s': round(self.elapsed, 3),
+            'timestamps': 'kernel' if self.kernel_samples else 'perf_counter_ns',
+            'kernel_samples': self.kernel_samples,
+        }
+        result.update(self.stats.summary())
+        return result
+
+def precise_ping(host, count=PRECISE_COUNT, interval=MULTI_PERIOD, timeout=MULTI_TIMEOUT, deadline=None,
+                 verbose=False, json_file=None, size=PRECISE_PAYLOAD):
+    """
+    对一个主机做高频ping（间隔可以小于1秒），结束后打印最小/平均/最大/mdev、抖动和分位数。
+    """
+    dest_addr = socket.gethostbyname(host)
+
+    def report(sequence, rtt, error):
+        if rtt is not None:
+            print(f"从 {dest_addr} 收到：icmp_seq={sequence} 时间={rtt*1000:.3f} ms")
+        else:
+            print(f"icmp_seq={sequence} {error}")
+
+    print(f"向 {host} ({dest_addr}) 每 {interval*1000:g} ms 发送ICMP请求：")
+    pinger = PrecisePing(dest_addr, count, interval, timeout, deadline, report if verbose else None, size).run()
+    summary = pinger.summary()
+    summary['host'] = host
+    if json_file:
+        out = sys.stdout if json_file == '-' else open(json_file, 'w', encoding='utf-8')
+        try:
+            out.write(json.dumps(summary, ensure_ascii=False) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    if json_file != '-':
+        print(f"--- {host} ping 统计信息 ---")
+        print(f"{summary['sent']} 包发送, {summary['received']} 接收, {summary['loss']}% 丢包, 用时 {pinger.elapsed*1000:.0f}ms")
+        if summary['received']:
+            print(f"rtt 最小/平均/最大/mdev = {summary['rtt_min_ms']:.3f}/{summary['rtt_avg_ms']:.3f}/"
+                  f"{summary['rtt_max_ms']:.3f}/{summary['rtt_mdev_ms']:.3f} ms")
+            percentiles = '/'.join(f"{summary['rtt_p%g_ms' % (p * 100)]:.3f}" for p in PRECISE_PERCENTILES)
+            names = '/'.join('p%g' % (p * 100) for p in PRECISE_PERCENTILES)
+            jitter = summary['jitter_ms'] if summary['jitter_ms'] is not None else 0.0
+            print(f"抖动 = {jitter:.3f} ms, {names} = {percentiles} ms, 时间戳来源: {summary['timestamps']}")
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ICMP ping；不带参数时进入交互模式")
+    parser.add_argument('targets', nargs='*', help="主机名、IP地址或CIDR网段，可以有多个")
+    parser.add_argument('-f', '--file', help="从文件读取目标，每行一个")
+    parser.add_argument('-c', '--count', type=int, help="每个目标的探测次数（默认1，--precise 模式默认%d，0表示不限）" % PRECISE_COUNT)
+    parser.add_argument('-t', '--timeout', type=float, default=MULTI_TIMEOUT * 1000, help="每个探测的超时（毫秒，默认1000）")
+    parser.add_argument('-p', '--period', type=float, default=MULTI_PERIOD * 1000, help="同一目标两次探测的间隔（毫秒，默认1000）")
+    parser.add_argument('-i', '--interval', type=float, default=MULTI_INTERVAL * 1000, help="相邻探测包之间的最小间隔（毫秒，默认1）")
+    parser.add_argument('-v', '--verbose', action='store_true', help="打印每个应答")
+    parser.add_argument('--json', help="把每个目标的统计按行写成JSON，'-' 表示标准输出")
+    parser.add_argument('--precise', action='store_true',
+                        help="单目标高频精确计时模式，-p 为发送间隔（可以小于1秒，如 -p 10）")
+    parser.add_argument('-w', '--deadline', type=float, help="--precise 模式的最长运行时间（秒）")
+    parser.add_argument('-s', '--size', type=int, default=PRECISE_PAYLOAD,
+                        help="--precise 模式的载荷字节数（默认%d，至少8）" % PRECISE_PAYLOAD)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # 命令行模式：多主机并发ping
+    args = parse_args()
+    specs = list(args.targets)
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            specs += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if args.precise:
+        if len(specs) != 1:
+            sys.exit("--precise 模式只能有一个目标")
+        count = PRECISE_COUNT if args.count is None else args.count
+        result = precise_ping(specs[0], count, args.period / 1000, args.timeout / 1000, args.deadline,
+                              args.verbose, args.json, args.size)
+        sys.exit(0 if result['received'] else 1)
+    count = 1 if args.count is None else args.count
+    results = multi_ping(specs, count, args.timeout / 1000, args.period / 1000, args.interval / 1000,
+                         args.verbose, args.json)
+    sys.exit(0 if any(result['received'] for result in results) else 1)
+
 if __name__ == "__main__":
     # 获取用户输入
     host_input = input("输入要ping的IP或主机名 [默认: lancaster.ac.uk]: ") or "lancaster.ac.uk"
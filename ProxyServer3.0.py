@@ -1,104 +1,743 @@
 # 导入 socket 库，用于网络通信
-from socket import socket, AF_INET, SOCK_STREAM, gethostbyname, gethostname
-# 导入 re 库，用于正则表达式操作
-import re
+from socket import socket, AF_INET, SOCK_STREAM, gethostname, getaddrinfo
+# 导入 ipaddress 库，用于判断请求的目标是不是代理自己
+import ipaddress
 # 导入 select 库，用于 I/O 多路复用
 import select
 import os
+# 导入 time 库，用于空闲连接的过期判断
+import time
+# 导入 threading 库，用于同一URL并发未命中时的合并
+import threading
+# 导入线程池，用于并发处理多个客户端
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urljoin, urldefrag
+# 导入 HTML 解析器，用于预取页面引用的资源
+from html.parser import HTMLParser
+# 导入共用的增量式请求头解析器
+from http_parser import RequestParser, ResponseParser, ChunkedDecoder, Headers, HTTPParseError
+# 导入带索引、新鲜度和容量限制的磁盘缓存
+from proxy_cache import ProxyCache, CacheFormatError, storable, entry_prefix, read_entry_head
+# 导入带TTL的DNS解析缓存
+from dns_cache import DNSCache
+# 导入计数器和直方图，用于运行指标
+import metrics
 
-# 定义一个函数，用于从 URL 生成文件名
-def generate_filename_from_url(url):
-    # 使用正则表达式替换 URL 中的非字母数字字符为下划线，并添加 '.html' 扩展名
-    return re.sub(r'[^\w]', '_', url) + '.html'
+# 运行指标的地址：直接向代理请求这个路径（不是代理请求）时返回Prometheus文本格式的指标
+METRICS_PATH = "/metrics"
 
-# 定义一个函数，用于处理客户端的请求
-def handle_request(client_socket, client_address):
-    # 从客户端套接字接收数据
-    sentence = client_socket.recv(1024).decode()# decode把bytes解码成字符串
-    # 打印接收到的数据和客户端地址.在大括号内部的内容会被解释为表达式并计算出结果
-    print(f"Received from {client_address}:")
-    print(sentence)# 请求头部信息
+# 缓存参数
+PROXY_CACHE_DIR = "proxy_cache"             # 缓存根目录
+PROXY_CACHE_BYTES = 256 * 1024 * 1024       # 缓存文件的总字节预算
+PROXY_STALE_WHILE_REVALIDATE = 0            # 源站没有指定时，过期后仍可先返回旧内容、后台重新验证的秒数（0表示关闭）
+REVALIDATE_WORKERS = 4                      # 后台重新验证的线程数
+
+# 预取参数：缓存HTML页面后，在后台把它引用的同源资源也取进缓存
+PREFETCH_ENABLED = False                    # 默认关闭
+PREFETCH_WORKERS = 4                        # 同时进行的预取请求数
+PREFETCH_MAX_LINKS = 32                     # 每个页面最多预取的资源数
+PREFETCH_BYTE_BUDGET = 8 * 1024 * 1024      # 每个页面预取的总字节数上限
+PREFETCH_MAX_HTML = 1024 * 1024             # 只解析页面的前这么多字节
+# 全局缓存，在start_proxy_server中创建
+proxy_cache = None
+# 代理监听的 (地址, 端口) 和本机的地址，在start_proxy_server中设置，用来发现指向代理自己的请求
+listen_address = None
+local_addresses = set()
+
+# 代理服务器的并发参数
+PROXY_WORKERS = 32      # 同时处理客户端请求的线程数
+PROXY_BACKLOG = 128     # 监听队列长度
+CLIENT_TIMEOUT = 10     # 客户端套接字的读写超时（秒），连上后不说话的客户端不会一直占着工作线程
+
+# 源站连接池参数
+ORIGIN_MAX_PER_HOST = 6       # 每个源站同时打开的最大连接数（使用中+空闲）
+ORIGIN_IDLE_TIMEOUT = 30      # 空闲连接超过这个秒数就关闭，源站多半已经关掉了它
+ORIGIN_TIMEOUT = 10           # 连接和读取源站的超时时间（秒）
+
+# 一条到源站的连接
+class OriginConnection:
+    def __init__(self, key, sock):
+        self.key = key              # (主机, 端口)
+        self.sock = sock
+        self.last_used = time.monotonic()
+
+    # 空闲连接是否还能用：没有过期，并且源站没有关闭它（可读说明收到了FIN或多余的数据）
+    def usable(self):
+        if time.monotonic() - self.last_used > ORIGIN_IDLE_TIMEOUT:
+            return False
+        try:
+            readable = select.select([self.sock], [], [], 0)[0]
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+# 代理的运行指标
+registry = metrics.Registry()
+requests_total = registry.counter('proxy_requests_total', 'Client requests received')
+active_connections = registry.gauge('proxy_active_connections', 'Client connections being handled')
+cache_hits = registry.counter('proxy_cache_hits_total', 'Requests served from a fresh cache entry')
+cache_misses = registry.counter('proxy_cache_misses_total', 'Requests without a usable cache entry, including stale entries to revalidate')
+stale_served = registry.counter('proxy_cache_stale_served_total', 'Stale entries served while revalidating')
+coalesced_requests = registry.counter('proxy_coalesced_requests_total', 'Misses that waited for another fetch of the same URL')
+revalidations = registry.counter('proxy_revalidations_total', 'Stale entries confirmed by a 304 from the origin')
+bytes_from_cache = registry.counter('proxy_bytes_from_cache_total', 'Body bytes sent to clients from the cache')
+bytes_from_origin = registry.counter('proxy_bytes_from_origin_total', 'Body bytes received from origins')
+upstream_connect = registry.histogram('proxy_upstream_connect_seconds', 'DNS resolution and TCP connect time for new origin connections')
+upstream_ttfb = registry.histogram('proxy_upstream_ttfb_seconds', 'Time from sending a request to receiving the origin response head')
+upstream_total = registry.histogram('proxy_upstream_total_seconds', 'Time from sending a request to the end of the origin response body')
+request_duration = registry.histogram('proxy_request_duration_seconds', 'Time to handle a client request')
+registry.gauge_function('proxy_cache_entries', 'Entries in the cache index', lambda: proxy_cache.stats()['entries'])
+registry.gauge_function('proxy_cache_bytes', 'Bytes used by cache entries', lambda: proxy_cache.stats()['bytes'])
+registry.counter_function('proxy_cache_evictions_total', 'Cache entries evicted to stay within the byte budget',
+                          lambda: proxy_cache.stats()['evictions'])
+registry.counter_function('proxy_dns_hits_total', 'DNS lookups answered from the cache', lambda: dns_cache.stats()['hits'])
+registry.counter_function('proxy_dns_misses_total', 'DNS lookups sent to the resolver', lambda: dns_cache.stats()['misses'])
+
+# 通过DNS缓存解析源站地址（IPv4或IPv6）并依次尝试连接，返回连上的套接字
+def connect_origin(host, port):
+    begin = time.perf_counter()
+    addresses = dns_cache.resolve(host, port)
+    error = None
+    for family, socktype, proto, _, sockaddr in addresses:
+        sock = socket(family, socktype, proto)
+        sock.settimeout(ORIGIN_TIMEOUT)
+        try:
+            sock.connect(sockaddr)
+            upstream_connect.observe(time.perf_counter() - begin)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e       # 这个地址连不上，试下一个
+    raise error
+
+# 按源站分组的keep-alive连接池。每个源站最多ORIGIN_MAX_PER_HOST条连接，满了就等待有连接归还
+class OriginPool:
+    def __init__(self, max_per_host=ORIGIN_MAX_PER_HOST):
+        self.max_per_host = max_per_host
+        self.condition = threading.Condition()
+        self.idle = {}      # (主机, 端口) -> [OriginConnection, ...]，最近归还的在最后
+        self.counts = {}    # (主机, 端口) -> 打开的连接数
+
+    # 取一条连接，返回 (连接, 是否是复用的连接)。没有可用的空闲连接时新建
+    def acquire(self, host, port):
+        key = (host, port)
+        with self.condition:
+            while True:
+                idle = self.idle.get(key)
+                while idle:
+                    conn = idle.pop()
+                    if conn.usable():
+                        return conn, True
+                    conn.close()              # 过期或已被源站关闭
+                    self.counts[key] -= 1
+                if self.counts.get(key, 0) < self.max_per_host:
+                    self.counts[key] = self.counts.get(key, 0) + 1
+                    break
+                self.condition.wait()
+        try:
+            # 在锁外面解析和连接，不阻塞其他源站
+            sock = connect_origin(host, port)
+        except Exception:
+            self.discard_key(key)
+            raise
+        return OriginConnection(key, sock), False
+
+    # 归还连接。reusable为False时（源站要求关闭、响应没读完等）关闭它
+    def release(self, conn, reusable):
+        if not reusable:
+            conn.close()
+            self.discard_key(conn.key)
+            return
+        conn.last_used = time.monotonic()
+        with self.condition:
+            self.idle.setdefault(conn.key, []).append(conn)
+            self.condition.notify()
+
+    def discard_key(self, key):
+        with self.condition:
+            self.counts[key] -= 1
+            self.condition.notify()
+
+# 全局的DNS解析缓存和源站连接池
+dns_cache = DNSCache()
+origin_pool = OriginPool()
+
+# 源站的一个响应：响应头已经读完，响应体按Content-Length或分块编码边读边交给调用者，不再靠超时判断结束
+class OriginResponse:
+    def __init__(self, conn, parser, head, method):
+        self.conn = conn
+        self.parser = parser        # 里面是响应头后面已经收到的字节
+        self.head = head
+        self.mode, self.length = head.framing(method)
+        self.finished = False
+
+    # 逐块产生响应体（分块编码已解码）。读完后把连接放回连接池
+    def read_chunks(self):
+        sock = self.conn.sock
+        pending = bytes(self.parser.buffer)
+        reusable = self.head.keep_alive()
+        if self.mode == 'none':
+            reusable = reusable and not pending
+        elif self.mode == 'length':
+            remaining = self.length
+            while remaining > 0:
+                data = pending[:remaining] if pending else sock.recv(min(65536, remaining))
+                if not data:
+                    raise ConnectionError("Origin closed connection in the middle of the body")
+                reusable = reusable and len(pending) <= remaining   # 多出来的字节说明响应有问题，不再复用
+                pending = b''
+                remaining -= len(data)
+                yield data
+        elif self.mode == 'chunked':
+            decoder = ChunkedDecoder()
+            data = pending
+            while True:
+                chunk = decoder.feed(data)
+                if chunk:
+                    yield chunk
+                if decoder.done:
+                    break
+                data = sock.recv(65536)
+                if not data:
+                    raise ConnectionError("Origin closed connection in the middle of the body")
+            reusable = reusable and not decoder.buffer
+        else:
+            # 没有长度信息，只能读到源站关闭连接
+            data = pending
+            while data:
+                yield data
+                data = sock.recv(65536)
+            reusable = False
+        self.finished = True
+        origin_pool.release(self.conn, reusable)
+
+    # 提前结束（客户端断开、出错）时关闭连接，响应体没读完的连接不能再用
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            origin_pool.release(self.conn, False)
+
+# 从源站连接读取响应头，跳过1xx临时响应
+def read_origin_head(sock):
+    parser = ResponseParser()
+    while True:
+        head = parser.next_response()
+        if head is None:
+            data = sock.recv(65536)
+            if not data:
+                raise ConnectionError("Origin closed connection before response head")
+            parser.feed(data)
+        elif not 100 <= head.status < 200:    # 跳过1xx临时响应
+            return parser, head
+
+# 通过连接池向源站发送请求，读完响应头后返回OriginResponse。
+# 复用的连接可能刚好被源站关闭，这种情况换一条新连接重试一次
+def origin_request(host, port, request_content, method='GET'):
+    while True:
+        conn, reused = origin_pool.acquire(host, port)
+        try:
+            sent_at = time.perf_counter()
+            conn.sock.sendall(request_content)
+            parser, head = read_origin_head(conn.sock)
+            upstream_ttfb.observe(time.perf_counter() - sent_at)
+        except (ConnectionError, TimeoutError, OSError) as e:
+            origin_pool.release(conn, False)
+            if reused and not isinstance(e, TimeoutError):
+                continue     # 过期的keep-alive连接，用新连接重试
+            raise
+        except Exception:
+            origin_pool.release(conn, False)
+            raise
+        response = OriginResponse(conn, parser, head, method)
+        response.sent_at = sent_at
+        return response
+
+# 一次正在进行的源站请求，等待同一结果的其他线程阻塞在event上
+class FlightCall:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+# 合并对同一个key的并发调用（single-flight）：第一个线程（leader）真正执行，
+# 其余线程等待并直接使用它的结果，热门页面过期时不会同时向源站发出N个相同请求
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}    # key -> FlightCall
+
+    # 返回 (结果, 是否复用了其他线程的结果)。leader抛出的异常会同样抛给等待的线程
+    def do(self, key, fn, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = FlightCall()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]    # 之后的请求重新检查缓存
+            call.event.set()
+        return call.result, False
+
+    # key是否有正在进行的调用
+    def running(self, key):
+        with self.lock:
+            return key in self.calls
 
-    # 将 HTTP 请求分割成多个部分，并将结果存储在一个列表中,取出索引为2
-    url_needed = re.split("/", sentence, 3)[2] # 用来提取客户端请求中的目标 URL 的部分。
-    # 生成文件名
-    filename = generate_filename_from_url(url_needed)
+# 全局的未命中合并器，按缓存键（完整URL）合并
+fetch_flight = SingleFlight()
 
+# 逐跳（hop-by-hop）的头只对一条连接有效，代理不能转发
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate', 'proxy-authorization',
+                      'te', 'trailer', 'transfer-encoding', 'upgrade'}
+
+# 打开缓存条目并读出它的响应头，返回 (条目, 文件, 响应头, 响应体偏移量)，没有时返回None。过期的条目也会返回
+def open_entry(cache_key, count=True):
+    cached = proxy_cache.open(cache_key, count)
+    if cached is None:
+        return None
+    entry, f = cached
     try:
-        # 尝试打开文件
-        with open(filename, "r") as f:
-            # 读取文件内容
-            file_content = f.read()
-            # 打印缓存命中信息
-            print(f"Cache hit. Serving content from {filename}")
-            # 发送 HTTP 响应头
-            response = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n"
-
-            # 将构造的HTTP响应头发送给客户端，以通知客户端响应状态和内容类型。
-            client_socket.send(response.encode())
-            # 发送文件内容
-            client_socket.send(file_content.encode())
-    except FileNotFoundError:
-        # 如果文件不存在，打印缓存未命中信息
+        stored_head, body_offset = read_entry_head(f)
+    except CacheFormatError:
+        f.close()
+        proxy_cache.invalidate(cache_key)      # 损坏的条目，删掉后按未命中处理
+        return None
+    return entry, f, stored_head, body_offset
+
+# 打开新鲜的缓存条目，没有或已过期时返回None
+def open_fresh(cache_key, count=True):
+    cached = open_entry(cache_key, count)
+    if cached is not None and not cached[0].is_fresh():
+        cached[1].close()
+        return None
+    return cached
+
+# 把缓存条目发给客户端：条目里存的是源站的原始字节，响应头补上长度后发送，响应体用sendfile直接从文件发到套接字，
+# 不经过解码和编码，也不复制到Python的内存中
+def serve_from_cache(client_socket, cached):
+    entry, f, stored_head, body_offset = cached
+    with f:
+        body_length = os.fstat(f.fileno()).st_size - body_offset
+        # 发送 HTTP 响应头
+        client_socket.sendall(stored_head + b"Content-Length: %d\r\nConnection: close\r\n\r\n" % body_length)
+        # 发送文件内容
+        client_socket.sendfile(f, body_offset, body_length)
+    bytes_from_cache.inc(body_length)
+
+# 源站响应头中转发给客户端、也存进缓存的部分：状态行和端到端的头（每行以CRLF结尾）。
+# 逐跳的头不转发；分块编码已经被解码，Content-Length由发送时重新计算
+def end_to_end_head(head):
+    lines = [b"HTTP/1.1 %d %s\r\n" % (head.status, head.reason.encode('latin-1'))]
+    for name, value in head.headers.items():
+        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != 'content-length':
+            lines.append((name + ": " + value + "\r\n").encode('latin-1'))
+    return b"".join(lines)
+
+# 未命中时发给客户端的响应头，长度已知时带上Content-Length，否则客户端读到连接关闭为止
+def client_response_head(stored_head, head, mode, length):
+    extra = b""
+    if mode in ('length', 'none') and not 100 <= head.status < 200 and head.status not in (204, 304):
+        extra = b"Content-Length: %d\r\n" % length
+    return stored_head + extra + b"Connection: close\r\n\r\n"
+
+# 存储的响应头用304响应中的头更新（RFC 7234 4.3.4），返回 (合并后的Headers, 新的存储响应头字节)。
+# 前者用来重新计算新鲜期，后者写回缓存条目并发给客户端；304里的逐跳头和Content-Length不参与合并
+def merge_headers(stored_head, updated):
+    parser = ResponseParser()
+    parser.feed(stored_head + b"\r\n")
+    stored = parser.next_response()
+    updates = Headers((name, value) for name, value in updated.items()
+                      if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != 'content-length')
+    merged = Headers()
+    for name, value in stored.headers.items():
+        if name not in updates:
+            merged.add(name, value)
+    for name, value in updates.items():
+        merged.add(name, value)
+    lines = [stored_head.split(b"\r\n", 1)[0] + b"\r\n"]
+    for name, value in merged.items():
+        lines.append((name + ": " + value + "\r\n").encode('latin-1'))
+    return merged, b"".join(lines)
+
+# 向源站请求页面，一边把收到的字节转发给客户端，一边写入缓存的临时文件，响应完整收到后才提交缓存条目。
+# 内存占用和对象大小无关，客户端的首字节时间接近源站的首字节时间。
+# stale是过期的缓存条目（open_entry的结果）时带上If-None-Match/If-Modified-Since做条件请求，
+# 源站回复304就只更新条目的新鲜期，把缓存的内容发给客户端。client_socket为None时只更新缓存（后台重新验证）
+def stream_from_origin(client_socket, url_needed, path, cache_key, stale=None):
+    # 分出主机和端口，url_needed可能带有 :端口
+    parts = urlsplit("//" + url_needed)
+    # 构造完整的 URL
+    full_url = "http://" + url_needed + path
+    # 构造 HTTP 请求内容。HTTP/1.1默认保持连接，连接读完响应后放回连接池给下一次未命中使用
+    request_content = "GET " + full_url + " HTTP/1.1\r\n" + "Host: " + url_needed + "\r\n"
+    if stale is not None:
+        entry = stale[0]
+        # 打印重新验证信息
+        print(f"Cache stale. Revalidating {cache_key}")
+        if entry.etag:
+            request_content += "If-None-Match: " + entry.etag + "\r\n"
+        if entry.last_modified:
+            request_content += "If-Modified-Since: " + entry.last_modified + "\r\n"
+    else:
+        # 打印缓存未命中信息
         print(f"Cache miss. Fetching content from {url_needed}")
-        # 获取服务器 IP 地址，解析主机名或域名并返回对应的 IP 地址
-        server_name = gethostbyname(url_needed)
-        # 打印解析的服务器信息
-        print(f"Resolved {url_needed} to {server_name}")
-        # 设置服务器端口
-        server_port = 80
-        # 创建一个新的套接字
-        host_socket = socket(AF_INET, SOCK_STREAM)
-        # 连接到服务器
-        host_socket.connect((server_name, server_port))
-        # 构造完整的 URL
-        full_url = "http://" + url_needed + "/"
-        # 构造 HTTP 请求内容
-        request_content = "GET " + full_url + " HTTP/1.1\r\n" + "Host: " + url_needed + "\r\n\r\n"
-        # 发送请求到服务器
-        host_socket.send(request_content.encode())
-        # 初始化响应变量，这个变量将在后续的代码中用于存储从服务器接收到的响应数据
-        response = ""
-        # 设置非阻塞模式。在等待服务器响应时不阻塞程序的执行。
-        host_socket.setblocking(0)
-
-        # 循环接收数据
-        while True:
-            # 使用 select 检查套接字是否可读。接受四个参数，分别是要检查的套接字列表
-            # 检查可写性的套接字列表，用于检查异常情况的套接字列表，以及一个超时值。
-            readable = select.select([host_socket], [], [], 2)# 可读、可写、异常
-
-            # 如果host_socket可读，readable列表将包含host_socket，否则将为空列表。
-            # 这是一种非阻塞操作，允许程序继续执行后续操作，而不必一直等待数据到达。
-            # 这个函数在指定的超时时间内等待套接字变得可读，
-            # 如果在超时时间内套接字变得可读，它将返回一个包含可读套接字的列表，否则返回一个空列表
-            if readable[0]:# 意味着host_socket可读，有数据可接收；
-                # 如果在 2 秒内没有数据可读，循环也会退出，以防止程序一直等待数据的到达。
-
-                # 接收数据
-                received_data = host_socket.recv(4096).decode("gbk", "ignore")# 数据被解码为GBK编码，并忽略了无法解码的字符。
-                # 追加到响应变量
-                response += received_data
+    request_content += "\r\n"
+    try:
+        response = origin_request(parts.hostname, parts.port or 80, request_content.encode())
+    except Exception:
+        if stale is not None:
+            stale[1].close()
+        raise
+    response_time = time.time()
+    head = response.head
+    if stale is not None:
+        if head.status == 304:
+            # 内容没有变化：读完（空的）响应体让连接回到连接池，更新新鲜期后使用缓存的内容
+            for _ in response.read_chunks():
+                pass
+            merged, new_head = merge_headers(stale[2], head.headers)
+            entry = proxy_cache.refresh(cache_key, merged, response_time, new_head)
+            revalidations.inc()
+            if entry is not None:
+                print(f"Revalidated {cache_key}. Fresh for {max(0, entry.expires_at - response_time):.0f}s")
+            if client_socket is not None:
+                # 响应体仍然从已经打开的旧文件发送，响应头用更新后的
+                serve_from_cache(client_socket, (stale[0], stale[1], new_head, stale[3]))
             else:
-                # 不管是因为成功接收完所有数据还是因为没有更多数据可读而退出循环
+                stale[1].close()
+            return
+        stale[1].close()          # 内容变了，按新的响应处理
+    stored_head = end_to_end_head(head)
+    f = temp_path = None
+    if storable(head.status, head.headers):
+        f, temp_path = proxy_cache.create_temp()
+        prefix = entry_prefix(stored_head)
+        f.write(prefix)           # 条目文件以响应头开头，后面是响应体的原始字节
+    client_ok = client_socket is not None
+    size = 0
+    try:
+        try:
+            if client_ok:
+                client_socket.sendall(client_response_head(stored_head, head, response.mode, response.length))
+        except OSError:
+            client_ok = False
+        for chunk in response.read_chunks():
+            if client_ok:
+                try:
+                    client_socket.sendall(chunk)
+                except OSError:
+                    client_ok = False       # 客户端断开了，还要写缓存的话继续读完
+            size += len(chunk)
+            if f is not None:
+                f.write(chunk)
+                if size > proxy_cache.max_bytes:    # 比整个缓存还大，不缓存了
+                    f.close()
+                    proxy_cache.discard_temp(temp_path)
+                    f = None
+            if not client_ok and f is None:
                 break
-        # 关闭套接字
-        host_socket.close()
-
-        # 将接收到的内容写入文件
-        with open(filename, 'w') as f:
-            # 从一个文本中提取 HTML 部分
-            # 使用索引[-1]来获取分割后的部分列表中的最后一个部分，即响应的HTML内容。
-            html = "<html" + re.split("<html", response, 10)[-1]# 响应拆分得太多，只分割最多10个部分。
-            # 写入文件
-            f.write(html)
+        if response.finished:
+            upstream_total.observe(time.perf_counter() - response.sent_at)
+        if f is not None and response.finished:
+            f.close()
+            f = None
+            entry = proxy_cache.commit(cache_key, temp_path, size + len(prefix), head.headers, response_time)
             # 打印接收和保存信息
-            print(f"Received {len(response)} bytes of content from {url_needed}. Saved to {filename}")
+            if entry is not None:
+                print(f"Received {size} bytes of content from {cache_key}. "
+                      f"Cached for {max(0, entry.expires_at - response_time):.0f}s")
+                # 客户端请求的HTML页面写入缓存后预取它引用的资源；预取到的页面不再继续预取
+                if client_socket is not None and PREFETCH_ENABLED:
+                    prefetch_pool.submit(schedule_prefetch, cache_key, entry)
+        else:
+            print(f"Received {size} bytes of content from {cache_key}. Not cached")
+    finally:
+        bytes_from_origin.inc(size)
+        response.close()
+        if f is not None:           # 响应没有完整收到，丢弃写了一半的条目
+            f.close()
+            proxy_cache.discard_temp(temp_path)
+
+# single-flight的leader执行的未命中处理。开始前可能有另一个leader刚刚完成，先再检查一次缓存；
+# 有过期但带验证器（ETag/Last-Modified）的条目时做条件请求
+def fetch_for_leader(client_socket, url_needed, path, cache_key):
+    cached = open_entry(cache_key, count=False)
+    if cached is not None and cached[0].is_fresh():
+        if client_socket is not None:
+            serve_from_cache(client_socket, cached)
+        else:
+            cached[1].close()
+        return
+    if cached is not None and not cached[0].has_validators():
+        cached[1].close()
+        cached = None
+    stream_from_origin(client_socket, url_needed, path, cache_key, cached)
+
+# 后台重新验证的线程池
+revalidate_pool = ThreadPoolExecutor(max_workers=REVALIDATE_WORKERS)
+
+# 在后台重新验证过期的条目。已经有线程在请求这个URL时不再重复
+def revalidate_in_background(url_needed, path, cache_key):
+    def revalidate():
+        try:
+            fetch_flight.do(cache_key, fetch_for_leader, None, url_needed, path, cache_key)
+        except Exception as e:
+            print(f"Error revalidating {cache_key}: {e}")
+    if not fetch_flight.running(cache_key):
+        revalidate_pool.submit(revalidate)
 
-        # 构造客户端响应
-        response_to_client = "HTTP/1.1 200 OK\r\n\r\n" + html
-        # 发送响应到客户端
-        client_socket.send(response_to_client.encode())
+# 从HTML中收集<link href>、<script src>和<img src>引用的资源
+class LinkExtractor(HTMLParser):
+    LINK_RELS = {'stylesheet', 'icon', 'shortcut', 'preload', 'modulepreload', 'apple-touch-icon'}
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'link' and attrs.get('href') and self.LINK_RELS & set((attrs.get('rel') or '').lower().split()):
+            self.links.append(attrs['href'])
+        elif tag in ('script', 'img') and attrs.get('src'):
+            self.links.append(attrs['src'])
+
+# 从缓存的HTML页面中找出同源的资源URL，按出现顺序去重
+def page_links(cache_key, cached):
+    entry, f, stored_head, body_offset = cached
+    with f:
+        f.seek(body_offset)
+        html = f.read(PREFETCH_MAX_HTML)
+    charset = 'utf-8'
+    for param in (entry.content_type or '').split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            charset = value.strip('"')
+    try:
+        text = html.decode(charset, 'replace')
+    except LookupError:               # 不认识的字符集
+        text = html.decode('utf-8', 'replace')
+    extractor = LinkExtractor()
+    extractor.feed(text)
+    origin = urlsplit(cache_key).netloc
+    links = []
+    for link in extractor.links:
+        url = urldefrag(urljoin(cache_key, link.strip()))[0]
+        parts = urlsplit(url)
+        if parts.scheme == 'http' and parts.netloc == origin and url != cache_key and url not in links:
+            links.append(url)
+    return links[:PREFETCH_MAX_LINKS]
+
+# 预取请求的线程池，线程数就是预取的并发上限
+prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+
+# 一个页面的预取任务共享的字节预算。每个请求开始前检查，资源大小事先不知道，最多超出正在进行的那几个请求
+class PrefetchBudget:
+    def __init__(self, total):
+        self.remaining = total
+        self.lock = threading.Lock()
+
+    def exhausted(self):
+        with self.lock:
+            return self.remaining <= 0
+
+    def spend(self, size):
+        with self.lock:
+            self.remaining -= size
+
+# 预取一个资源：已经有新鲜的缓存就跳过，否则和普通未命中一样通过single-flight取进缓存（不发给任何客户端）
+def prefetch_one(url, budget):
+    if budget.exhausted():
+        return
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    try:
+        cached = open_fresh(url, count=False)
+        if cached is not None:
+            cached[1].close()
+            return
+        fetch_flight.do(url, fetch_for_leader, None, parts.netloc, path, url)
+        cached = proxy_cache.open(url, count=False)
+        if cached is not None:
+            cached[1].close()
+            budget.spend(cached[0].size)
+    except Exception as e:
+        print(f"Error prefetching {url}: {e}")
+
+# 刚缓存的HTML页面：在预取线程中解析它，把引用的同源资源排进预取队列，浏览器随后的子资源请求就能命中缓存
+def schedule_prefetch(cache_key, entry):
+    if 'html' not in (entry.content_type or '').lower():
+        return
+    cached = open_entry(cache_key, count=False)
+    if cached is None:
+        return
+    try:
+        links = page_links(cache_key, cached)
+    except Exception as e:
+        print(f"Error parsing {cache_key} for prefetch: {e}")
+        return
+    if links:
+        print(f"Prefetching {len(links)} resources referenced by {cache_key}")
+    budget = PrefetchBudget(PREFETCH_BYTE_BUDGET)
+    for url in links:
+        prefetch_pool.submit(prefetch_one, url, budget)
+
+# 发给代理自己（而不是通过代理访问其他网站）的请求：目标是路径，Host是本机或者没有
+def is_local_request(request):
+    if not request.target.startswith("/"):
+        return False
+    host = urlsplit("//" + request.headers.get('host', '')).hostname
+    return host in (None, "localhost", "127.0.0.1", "::1", gethostname().lower())
+
+# 请求的目标主机是不是代理自己。源站形式的请求（GET /path）的Host通常就是代理，
+# 如果照样转发，代理会连接自己、等到ORIGIN_TIMEOUT超时，期间占着两个工作线程
+def is_self_target(url_needed):
+    parts = urlsplit("//" + url_needed)
+    try:
+        port = parts.port or 80
+    except ValueError:
+        return False
+    if listen_address is None or port != listen_address[1]:
+        return False
+    host = parts.hostname
+    if host is None or host in ("localhost", gethostname().lower(), listen_address[0].lower()) or host in local_addresses:
+        return True
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_unspecified
+
+# 回复一个带简短文本说明的错误响应
+def send_error(client_socket, status, message):
+    body = (message + "\n").encode()
+    head = "HTTP/1.1 " + status + "\r\nContent-Type: text/plain\r\nContent-Length: " + str(len(body)) + \
+           "\r\nConnection: close\r\n\r\n"
+    client_socket.sendall(head.encode() + body)
+
+# 返回Prometheus文本格式的运行指标
+def serve_metrics(client_socket):
+    body = registry.render().encode()
+    head = "HTTP/1.1 200 OK\r\nContent-Type: " + metrics.CONTENT_TYPE + "\r\nContent-Length: " + str(len(body)) + \
+           "\r\nConnection: close\r\n\r\n"
+    client_socket.sendall(head.encode() + body)
+
+# 定义一个函数，用于处理客户端的请求，同时统计活动连接数和处理时间
+def handle_request(client_socket, client_address):
+    active_connections.inc()
+    begin = time.perf_counter()
+    try:
+        process_request(client_socket, client_address)
+    finally:
+        active_connections.dec()
+        request_duration.observe(time.perf_counter() - begin)
+
+def process_request(client_socket, client_address):
+    # 从客户端套接字增量地接收并解析请求头，请求头分几次到达或者比一次recv更长也能正确处理。
+    # 解析直接在bytes上进行，不需要先把整个请求解码成字符串
+    parser = RequestParser()
+    request = None
+    client_socket.settimeout(CLIENT_TIMEOUT)
+    try:
+        while request is None:
+            data = client_socket.recv(4096)
+            if not data:
+                # 请求还没发完客户端就关闭了连接
+                print(f"Connection from {client_address} closed before request was complete")
+                client_socket.close()
+                return
+            parser.feed(data)
+            request = parser.next_request()
+    except HTTPParseError as e:
+        # 请求格式错误或太大，回复对应的错误状态
+        print(f"Bad request from {client_address}: {e}")
+        try:
+            client_socket.send(("HTTP/1.1 " + e.status + "\r\nContent-Length: 0\r\nConnection: close\r\n\r\n").encode())
+        except OSError:
+            pass
+        client_socket.close()
+        return
+    except OSError as e:
+        # 读取超时（socket.timeout是OSError的子类）或者连接被重置，直接关闭
+        print(f"Error reading request from {client_address}: {e}")
+        client_socket.close()
+        return
+    # 打印请求行和客户端地址.在大括号内部的内容会被解释为表达式并计算出结果
+    print(f"Received from {client_address}: {request.method} {request.target}")
+    requests_total.inc()
+
+    if request.target.split("?")[0] == METRICS_PATH and is_local_request(request):
+        try:
+            serve_metrics(client_socket)
+        except OSError as e:
+            print(f"Error sending metrics: {e}")
+        finally:
+            client_socket.close()
+        return
+
+    # 从请求的绝对URL（http://host/path）中取出主机部分，没有时使用Host头
+    url_needed = urlsplit(request.target).netloc or request.headers.get('host', '') # 用来提取客户端请求中的目标 URL 的部分。
+    if not url_needed or is_self_target(url_needed):
+        # 没有目标主机，或者目标就是代理自己：不转发，避免请求绕回代理
+        print(f"Refusing request from {client_address} for the proxy itself: {request.target}")
+        try:
+            send_error(client_socket, "400 BAD REQUEST", "This is a proxy; request an absolute URL of another server.")
+        except OSError as e:
+            print(f"Error sending response: {e}")
+        finally:
+            client_socket.close()
+        return
+    path = request.path()
+    # 缓存键是完整的URL，同一主机的不同路径分别缓存
+    cache_key = "http://" + url_needed + path
+
+    try:
+        # 先查缓存
+        cached = open_entry(cache_key)
+        if cached is not None and cached[0].is_fresh():
+            # 打印缓存命中信息
+            print(f"Cache hit. Serving content for {cache_key}")
+            cache_hits.inc()
+            serve_from_cache(client_socket, cached)
+        elif cached is not None and cached[0].can_serve_stale():
+            # 过期不久（stale-while-revalidate窗口内）：立即返回旧内容，同时在后台重新验证
+            print(f"Cache stale. Serving stale content for {cache_key} while revalidating")
+            stale_served.inc()
+            serve_from_cache(client_socket, cached)
+            revalidate_in_background(url_needed, path, cache_key)
+        else:
+            if cached is not None:
+                cached[1].close()     # 过期的条目由leader重新打开并做条件请求
+            cache_misses.inc()
+            # 缓存未命中：同一URL同时只有一个线程访问源站，其他线程等待它写好缓存后从缓存读取
+            _, shared = fetch_flight.do(cache_key, fetch_for_leader, client_socket, url_needed, path, cache_key)
+            if shared:
+                coalesced_requests.inc()
+                cached = open_fresh(cache_key, count=False)
+                if cached is not None:
+                    print(f"Served {cache_key} from a fetch in flight by another request")
+                    serve_from_cache(client_socket, cached)
+                else:
+                    # 响应不能缓存，自己向源站请求
+                    stream_from_origin(client_socket, url_needed, path, cache_key)
     except Exception as e:
         # 打印处理请求时的错误
         print(f"Error handling request: {e}")
@@ -108,6 +747,9 @@ def handle_request(client_socket, client_address):
 
 # 定义一个函数，用于启动代理服务器
 def start_proxy_server(server_address, server_port):
+    global proxy_cache, listen_address
+    # 打开缓存，加载上次保存的索引
+    proxy_cache = ProxyCache(PROXY_CACHE_DIR, PROXY_CACHE_BYTES, default_swr=PROXY_STALE_WHILE_REVALIDATE)
     # 创建套接字
     # Address Family - Internet，表示 IPv4 地址族。;
     # 基于流的套接字是一种可靠的、面向连接的套接字，通常用于 TCP 协议
@@ -116,25 +758,37 @@ def start_proxy_server(server_address, server_port):
 
     # 绑定套接字到地址和端口
     server_socket.bind((server_address, server_port))
+    listen_address = (server_address, server_port)
+    # 本机名解析到的地址，绑定到所有地址时客户端也可能用这些地址指向代理自己
+    try:
+        local_addresses.update(info[4][0] for info in getaddrinfo(gethostname(), None))
+    except OSError:
+        pass
 
     # 这是一个套接字对象的方法，用于开始监听连接请求
-    # 参数是1，这务器将允许最多1个客户端连接排队等待。如果有多个客户端尝试连接服务器，多余的连接将被服务器拒绝。
-    server_socket.listen(1)
+    # 参数是排队等待accept的最大连接数。请求由线程池并发处理，队列可以放得比原来的1大很多
+    server_socket.listen(PROXY_BACKLOG)
+    # 处理客户端请求的线程池，一个慢的源站请求不再阻塞其他客户端
+    pool = ThreadPoolExecutor(max_workers=PROXY_WORKERS)
     # 打印服务器准备就绪信息
     print('Server ready to receive')
 
-    # 无限循环等待连接
-    while True:
-        # 阻塞程序的执行，直到有客户端尝试连接。一旦有连接请求到达，它会返回一个新的套接字对象 'connection_socket'，以及连接的客户端地址 'addr'
-        connection_socket, addr = server_socket.accept()
-        # 处理请求
-        handle_request(connection_socket, addr)
-
-    # 关闭服务器套接字
-    server_socket.close()
-
-# 提示用户输入端口号
-print("Please set your own serverPort")
-port = int(input())
-# 启动代理服务器
-start_proxy_server("", port)
+    try:
+        # 无限循环等待连接
+        while True:
+            # 阻塞程序的执行，直到有客户端尝试连接。一旦有连接请求到达，它会返回一个新的套接字对象 'connection_socket'，以及连接的客户端地址 'addr'
+            connection_socket, addr = server_socket.accept()
+            # 交给线程池处理请求，主线程立即回到accept
+            pool.submit(handle_request, connection_socket, addr)
+    finally:
+        # 关闭服务器套接字，保存缓存索引，下次启动时直接加载
+        server_socket.close()
+        proxy_cache.save_index()
+        print("Cache stats:", proxy_cache.stats())
+
+if __name__ == "__main__":
+    # 提示用户输入端口号
+    print("Please set your own serverPort")
+    port = int(input())
+    # 启动代理服务器
+    start_proxy_server("", port)
@@ -5,6 +5,9 @@ import struct  # Import struct module for packing and unpacking data to and from
 import sys  # Import sys module for system-specific parameters and functions
 import time  # Import time module for time-related functions
 import select  # Import select module for efficient I/O multiplexing
+import heapq  # Import heapq module for the probe timeout heap of the parallel mode
+import argparse  # Import argparse module for the command line options
+from inet_checksum import checksum  # Shared Internet checksum (also used by ICMPPing)
 
 # Define constants for ICMP message types
 ICMP_ECHO_REQUEST = 8  # ICMP type code for echo request messages
@@ -12,35 +15,13 @@ ICMP_ECHO_REPLY = 0  # ICMP type code for echo reply messages
 TYPE_ICMP_OVERTIME = 11  # ICMP type code for indicating timeout (Time Exceeded)
 CODE_TTL_OVERTIME = 0  # ICMP code for Time To Live exceeded in transit
 TYPE_ICMP_UNREACHED = 3  # ICMP type code for unreachable destination
+CODE_PORT_UNREACHED = 3  # ICMP code for port unreachable (the destination answers UDP probes with it)
+MAX_HOPS = 30  # Highest TTL probed
+PROBES_PER_HOP = 3  # Probes sent for every TTL
+UDP_BASE_PORT = 33434  # First destination port of UDP probes; each probe uses its own port
 addr = None  # Initialize a global variable 'addr' to store the address
 timeSent = None  # Initialize a global variable 'timeSent' to store the time a packet is sent
 
-# Function to calculate checksum for packet integrity
-def checksum(string):
-    csum = 0  # Initialize checksum to 0
-    to_count = (len(string) / 2) * 2  # Compute the count for the checksum loop
-    count = 0  # Initialize count for the loop
-
-    # Loop to calculate checksum
-    while count < to_count:
-        this_val = string[count + 1] * 256 + string[count]  # Calculate the value for current bytes
-        csum = csum + this_val  # Add the value to the checksum
-        csum = csum & 0xffffffff  # Ensure checksum stays within 32 bits
-        count = count + 2  # Increment count by 2 bytes
-
-    # Check for any remaining bytes to be added to checksum
-    if count < len(string):
-        csum = csum + ord(string[len(string) - 1])  # Add the value of the last byte
-        csum = csum & 0xffffffff  # Ensure checksum stays within 32 bits
-
-    # Finalize the checksum calculation
-    csum = (csum >> 16) + (csum & 0xffff)  # Add high 16 bits to low 16 bits
-    csum = csum + (csum >> 16)  # Add carry from above step
-    answer = ~csum  # Take one's complement of the result
-    answer = answer & 0xffff  # Keep only the lower 16 bits
-    answer = answer >> 8 | (answer << 8 & 0xff00)  # Swap the bytes
-    return answer  # Return the computed checksum
-
 # Function to resolve an IP address to its corresponding hostname
 def get_host_name(des_addr):
     try:
@@ -178,7 +159,7 @@ def trace_one_hop(dest_add, timeout, ttl, prot):
 # Main function to perform traceroute to a specified host
 def trace(host, timeout, prot):
     global ID  # Declare ID as a global variable
-    ID = os.getpid()  # Set ID to the current process ID
+    ID = os.getpid() & 0xFFFF  # Set ID to the current process ID, truncated to the 16-bit ICMP id field
     ttl = 1  # Initialize TTL to 1
     dest_add = socket.gethostbyname(host)  # Resolve the host to an IP address
     max_hop = 30  # Set the maximum number of hops
@@ -194,6 +175,240 @@ def trace(host, timeout, prot):
             print("exceed max_hop")  # Print a message indicating the maximum hops exceeded
             sys.exit()  # Exit the program
 
+# A probe of the parallel mode and its result
+class HopProbe:
+    __slots__ = ('ttl', 'key', 'sent_at', 'rtt', 'address', 'done')
+
+    def __init__(self, ttl, key, sent_at):
+        self.ttl = ttl  # TTL the probe was sent with
+        self.key = key  # ICMP sequence number or UDP destination port offset identifying the probe
+        self.sent_at = sent_at  # perf_counter() when the probe left
+        self.rtt = None  # Round-trip time in seconds, None while unanswered or after a timeout
+        self.address = None  # Address of the router (or destination) that answered
+        self.done = False  # Answered or timed out
+
+# Parallel traceroute: probes for many TTLs are in flight at once on one persistent socket set
+class ParallelTrace:
+    """Trace a path with all TTLs (or a sliding window of them) probed at the same time.
+
+    Replies are matched to their probe by the ICMP id/sequence or the UDP
+    destination port quoted in the Time Exceeded / Unreachable message, so a
+    full trace takes about one timeout instead of hops x probes x timeout.
+    """
+    def __init__(self, dest_address, timeout=1, prot='ICMP', max_hops=MAX_HOPS, probes=PROBES_PER_HOP,
+                 window=MAX_HOPS, on_hop=None):
+        self.dest_address = dest_address
+        self.timeout = timeout
+        self.prot = prot
+        self.max_hops = max_hops
+        self.probes = probes
+        self.window = max(1, window)  # How many TTLs may have probes in flight at once
+        self.on_hop = on_hop  # Called as on_hop(ttl, probes) for each hop, in TTL order
+        self.identifier = os.getpid() & 0xFFFF  # ICMP id field is 16 bits
+        self.hops = {}  # TTL -> list of HopProbe
+        self.pending = {}  # Probe key -> HopProbe still waiting for an answer
+        self.deadlines = []  # Heap of (timeout time, key)
+        self.next_key = 0
+        self.dest_hop = None  # Lowest TTL answered by the destination itself
+        self.reported = 0  # Highest TTL already passed to on_hop
+        self.source_port = None  # Local port of the UDP probes
+
+    # Open the raw ICMP socket (and the UDP socket in UDP mode) used for the whole trace
+    def open_sockets(self):
+        self.recv_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.getprotobyname('icmp'))
+        self.recv_socket.setblocking(False)
+        if self.prot == "UDP":
+            self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.send_socket.bind(("", 0))  # Any free port; quoted UDP headers are matched against it
+            self.source_port = self.send_socket.getsockname()[1]
+        else:
+            self.send_socket = self.recv_socket  # ICMP probes go out on the receiving socket
+
+    def close_sockets(self):
+        if self.send_socket is not self.recv_socket:
+            self.send_socket.close()
+        self.recv_socket.close()
+
+    # Send all probes of one TTL; the socket TTL is changed right before the sends
+    def send_hop(self, ttl):
+        self.send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        self.hops[ttl] = []
+        for _ in range(self.probes):
+            self.next_key += 1
+            key = self.next_key
+            if self.prot == "UDP":
+                packet = struct.pack("!d", time.time())  # The kernel adds the UDP header
+                destination = (self.dest_address, UDP_BASE_PORT + key)
+            else:
+                header = struct.pack('!bbHHh', ICMP_ECHO_REQUEST, 0, 0, self.identifier, key)
+                data = struct.pack("!d", time.time())
+                header = struct.pack('!bbHHh', ICMP_ECHO_REQUEST, 0, checksum(header + data), self.identifier, key)
+                packet = header + data
+                destination = (self.dest_address, 1)
+            probe = HopProbe(ttl, key, time.perf_counter())
+            self.hops[ttl].append(probe)
+            try:
+                self.send_socket.sendto(packet, destination)
+            except OSError:
+                probe.done = True  # Counted as lost, like a timeout
+                continue
+            self.pending[key] = probe
+            heapq.heappush(self.deadlines, (probe.sent_at + self.timeout, key))
+
+    # Highest TTL that still matters: the destination's hop once it is known
+    def limit(self):
+        return self.dest_hop if self.dest_hop is not None else self.max_hops
+
+    def hop_done(self, ttl):
+        return ttl in self.hops and all(probe.done for probe in self.hops[ttl])
+
+    def run(self):
+        """Run the trace and return {ttl: [HopProbe, ...]} up to the destination's hop."""
+        self.open_sockets()
+        try:
+            next_ttl = 1
+            while True:
+                # Keep up to 'window' unfinished TTLs in flight
+                in_flight = sum(1 for ttl in self.hops if ttl > self.reported and not self.hop_done(ttl))
+                while next_ttl <= self.limit() and in_flight < self.window:
+                    self.send_hop(next_ttl)
+                    next_ttl += 1
+                    in_flight += 1
+                    self.drain()  # Timestamp early replies now instead of after the whole burst
+                # Report finished hops in TTL order
+                while self.reported < self.limit() and self.hop_done(self.reported + 1):
+                    self.reported += 1
+                    if self.on_hop:
+                        self.on_hop(self.reported, self.hops[self.reported])
+                if self.reported >= self.limit():
+                    break
+                # Wait for a reply or the next timeout of a probe that still matters
+                while self.deadlines and self.deadlines[0][1] not in self.pending:
+                    heapq.heappop(self.deadlines)
+                wait = max(0.0, self.deadlines[0][0] - time.perf_counter()) if self.deadlines else 0.0
+                ready, _, _ = select.select([self.recv_socket], [], [], wait)
+                if ready:
+                    self.drain()
+                self.expire()
+        finally:
+            self.close_sockets()
+        return {ttl: self.hops[ttl] for ttl in range(1, self.reported + 1)}
+
+    # Mark probes whose timeout passed as lost
+    def expire(self):
+        now = time.perf_counter()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, key = heapq.heappop(self.deadlines)
+            probe = self.pending.pop(key, None)
+            if probe is not None:
+                probe.done = True
+
+    def drain(self):
+        while True:
+            try:
+                packet, address = self.recv_socket.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            received_at = time.perf_counter()
+            key, from_destination = self.match(packet, address[0])
+            probe = self.pending.pop(key, None) if key is not None else None
+            if probe is None:
+                continue  # Not ours, a duplicate, or already timed out
+            probe.rtt = received_at - probe.sent_at
+            probe.address = address[0]
+            probe.done = True
+            if from_destination and (self.dest_hop is None or probe.ttl < self.dest_hop):
+                self.dest_hop = probe.ttl
+                # Probes beyond the destination will never be reported; stop waiting for them
+                for other_key in [k for k, p in self.pending.items() if p.ttl > self.dest_hop]:
+                    self.pending.pop(other_key).done = True
+
+    # Return (probe key, whether the destination answered) for a received ICMP packet
+    def match(self, packet, source):
+        if len(packet) < 28:
+            return None, False
+        header_length = (packet[0] & 0x0F) * 4  # The IP header may carry options
+        access_type, code = packet[header_length], packet[header_length + 1]
+        if access_type == ICMP_ECHO_REPLY and self.prot == "ICMP":
+            _, _, _, packet_id, sequence = struct.unpack("!bbHHh", packet[header_length:header_length + 8])
+            if packet_id == self.identifier and source == self.dest_address:
+                return sequence, True
+            return None, False
+        if access_type not in (TYPE_ICMP_OVERTIME, TYPE_ICMP_UNREACHED):
+            return None, False
+        # Time Exceeded and Unreachable quote the original IP header and the first 8 bytes after it
+        inner = packet[header_length + 8:]
+        if len(inner) < 20:
+            return None, False
+        inner_length = (inner[0] & 0x0F) * 4
+        quoted = inner[inner_length:inner_length + 8]
+        if len(quoted) < 8 or socket.inet_ntoa(inner[16:20]) != self.dest_address:
+            return None, False
+        if self.prot == "UDP" and inner[9] == socket.IPPROTO_UDP:
+            source_port, dest_port = struct.unpack("!HH", quoted[:4])
+            if source_port != self.source_port:
+                return None, False
+            key = dest_port - UDP_BASE_PORT
+        elif self.prot == "ICMP" and inner[9] == socket.IPPROTO_ICMP:
+            _, _, _, packet_id, key = struct.unpack("!bbHHh", quoted)
+            if packet_id != self.identifier:
+                return None, False
+        else:
+            return None, False
+        # An unreachable message from the destination itself (port unreachable for UDP) ends the path too
+        from_destination = access_type == TYPE_ICMP_UNREACHED and source == self.dest_address
+        return key, from_destination
+
+# Print one hop of the parallel trace in the same layout as trace_one_hop
+def print_parallel_hop(ttl, probes, resolve=True):
+    times = ["%.2f ms" % (probe.rtt * 1000) if probe.rtt is not None else "*" for probe in probes]
+    addresses = []
+    for probe in probes:
+        if probe.address is not None and probe.address not in addresses:
+            addresses.append(probe.address)  # Load-balanced paths may answer from several routers
+    if addresses:
+        names = ", ".join(get_host_name(address) if resolve else address for address in addresses)
+    else:
+        names = "time out"
+    print(str(ttl) + " " + " ".join(times) + " " + names)
+
+# Parallel traceroute to a host; returns True when the destination was reached
+def parallel_trace(host, timeout, prot, max_hops=MAX_HOPS, probes=PROBES_PER_HOP, window=MAX_HOPS, resolve=True):
+    dest_add = socket.gethostbyname(host)  # Resolve the host to an IP address
+    tracer = ParallelTrace(dest_add, timeout, prot, max_hops, probes, window,
+                           lambda ttl, hop_probes: print_parallel_hop(ttl, hop_probes, resolve))
+    begin = time.perf_counter()
+    tracer.run()
+    elapsed = time.perf_counter() - begin
+    if tracer.dest_hop is None:
+        print("exceed max_hop")
+    print("trace finished in %.2f s" % elapsed)
+    return tracer.dest_hop is not None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Traceroute; without arguments the interactive prompts are used")
+    parser.add_argument('host', help="IP address or host name to trace")
+    parser.add_argument('-t', '--timeout', type=float, default=1, help="probe timeout in seconds (default 1)")
+    parser.add_argument('-P', '--protocol', choices=('ICMP', 'UDP'), default='ICMP', help="probe protocol (default ICMP)")
+    parser.add_argument('-m', '--max-hops', type=int, default=MAX_HOPS, help="highest TTL (default %d)" % MAX_HOPS)
+    parser.add_argument('-q', '--queries', type=int, default=PROBES_PER_HOP, help="probes per hop (default %d)" % PROBES_PER_HOP)
+    parser.add_argument('-w', '--window', type=int, default=MAX_HOPS,
+                        help="TTLs probed at the same time (default all %d)" % MAX_HOPS)
+    parser.add_argument('-n', '--numeric', action='store_true', help="do not resolve hop addresses to names")
+    parser.add_argument('--serial', action='store_true', help="use the original hop-by-hop trace")
+    return parser.parse_args(argv)
+
+# Command line mode
+if __name__ == "__main__" and len(sys.argv) > 1:
+    args = parse_args()
+    prot = args.protocol  # send_oneping reads the protocol from this global
+    print("Tracing address: " + args.host + " " + socket.gethostbyname(args.host))
+    if args.serial:
+        trace(args.host, args.timeout, prot)
+        sys.exit()
+    reached = parallel_trace(args.host, args.timeout, prot, args.max_hops, args.queries, args.window, not args.numeric)
+    sys.exit(0 if reached else 1)
+
 # Entry point of the script
 if __name__ == "__main__":
     desAddr = input("Please enter the IP or host name[default(www.lancaster.ac.uk)]:\n")  # Prompt user to enter a destination address
@@ -210,6 +425,11 @@ if __name__ == "__main__":
     elif prot != 'ICMP' and prot != 'UDP':  # Check if the input is neither ICMP nor UDP
         print("Please enter 'ICMP' or 'UDP', default(ICMP)")  # Prompt the user to enter a valid protocol
 
+    parallel = input("Probe all hops in parallel (y or n)[default y]:\n")  # Prompt user to choose the trace mode
+
     # Start the traceroute process
     print("Tracing address: " + desAddr + " " + socket.gethostbyname(desAddr))  # Print the address being traced
-    trace(desAddr, int(timeout), prot)  # Call the trace function with the specified parameters
+    if parallel.lower().startswith('n'):
+        trace(desAddr, int(timeout), prot)  # Call the trace function with the specified parameters
+    else:
+        parallel_trace(desAddr, float(timeout), prot)  # Send the probes for all TTLs at once
@@ -4,112 +4,962 @@
 import socket                   # 导入 'socket' 模块，用于网络通信。
 import threading                # 导入 'threading' 模块，提供多线程支持。
 import os                       # 导入 'os' 模块，用于操作系统级别的接口，如文件管理。
+import queue                    # 导入 'queue' 模块，线程池模式下用有界队列缓存待处理的连接。
+import mimetypes                # 导入 'mimetypes' 模块，根据文件扩展名推断Content-Type。
+from email.utils import formatdate, parsedate_to_datetime   # HTTP日期格式（Last-Modified / If-Modified-Since）
+from collections import OrderedDict   # 有序字典，用于实现LRU缓存
+import tempfile                 # 导入 'tempfile' 模块，PUT上传先写入临时文件
+import uuid                     # 导入 'uuid' 模块，生成multipart响应的分隔符
+import gzip                     # 导入 'gzip' 和 'zlib' 模块，用于压缩响应
+import zlib
+import asyncio                  # 导入 'asyncio' 模块，asyncio模式下单线程处理大量连接
+from concurrent.futures import ThreadPoolExecutor   # asyncio模式下执行阻塞的文件操作
+import multiprocessing          # 导入 'multiprocessing' 模块，多进程（prefork）模式
+import signal                   # 导入 'signal' 模块，处理停止信号
+import time
+from http_parser import RequestParser, HTTPParseError, parse_request_head   # 增量式的请求头解析器
 
-# 定义处理客户端请求的函数，将在独立线程上运行
-def handle_request(tcp_socket):
-    print('Waiting for connection...')   # 打印信息，表示服务器正在等待连接。
+# 服务器并发模式
+SERVER_MODE_THREAD = "thread"   # 每个连接创建一个新线程（原始模式，无上限）
+SERVER_MODE_POOL = "pool"       # 固定数量的工作线程 + 有界的连接队列
+SERVER_MODE_ASYNCIO = "asyncio" # 单线程事件循环处理所有连接，文件操作交给线程池
+
+# 线程池饱和时的处理策略
+OVERLOAD_REJECT = "reject"      # 立即回复503并关闭连接
+OVERLOAD_WAIT = "wait"          # 暂停accept，直到队列有空位（由内核backlog承担排队）
+
+LOG_REQUESTS = True             # 是否打印每个请求的详细信息，压测时关闭以免输出拖慢服务器
+
+def log(*args):
+    if LOG_REQUESTS:
+        print(*args)
+
+shutdown_event = threading.Event()   # 设置后服务器停止接受新连接，处理完正在进行的请求后退出
+GRACEFUL_TIMEOUT = 20                # 停止时等待正在处理的连接结束的最长时间（秒）
+
+# 服务器统计计数器。单进程时保存在普通列表中；prefork模式下每个工作进程使用共享内存数组中属于自己的一段，
+# 由主进程汇总，进程之间不需要加锁
+STAT_FIELDS = ('connections', 'active_connections', 'requests',
+               'responses_2xx', 'responses_3xx', 'responses_4xx', 'responses_5xx', 'bytes_sent')
+
+class ServerStats:
+    def __init__(self, counters=None, offset=0):
+        self.counters = counters if counters is not None else [0] * len(STAT_FIELDS)
+        self.offset = offset
+        self.lock = threading.Lock()   # 同一进程内的多个线程共享计数器
+
+    def add(self, field, n=1):
+        index = self.offset + STAT_FIELDS.index(field)
+        with self.lock:
+            self.counters[index] += n
+
+    def get(self, field):
+        return self.counters[self.offset + STAT_FIELDS.index(field)]
+
+    def record_response(self, status, nbytes):
+        self.add('responses_%sxx' % status[0])
+        self.add('bytes_sent', nbytes)
+
+    def snapshot(self):
+        return {field: self.get(field) for field in STAT_FIELDS}
+
+server_stats = ServerStats()   # 当前进程的统计
+
+# 持久连接（HTTP/1.1 keep-alive）参数
+KEEP_ALIVE_TIMEOUT = 15          # 连接空闲超过15秒没有新请求就关闭
+MAX_KEEP_ALIVE_REQUESTS = 100    # 每个连接最多处理的请求数，达到后回复Connection: close
+MAX_HEADER_SIZE = 65536          # 请求头的最大长度，防止客户端无限发送请求头
+BODY_READ_TIMEOUT = 30           # asyncio模式下读取请求体时，每次读取的最长等待时间
+
+# 在支持的系统上，发送响应头时带上MSG_MORE，让内核把响应头和随后sendfile的文件内容合并成完整的TCP段
+MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+
+# 构造响应头中与连接无关的部分（状态行 + 响应头）。每个响应都带有准确的Content-Length，客户端才能在同一连接上区分相邻的响应
+def build_head_prefix(status, headers, content_length):
+    res_header = 'HTTP/1.1 ' + status + '\r\n'            # 状态行
+    for name, value in headers or []:
+        res_header += name + ': ' + value + '\r\n'        # 其他响应头
+    if not status.startswith('304'):                      # 304响应没有响应体，不能声明长度为0
+        res_header += 'Content-Length: %d\r\n' % content_length   # 响应体的字节数
+    return res_header.encode()
+
+# 响应头中与连接相关的部分（Connection / Keep-Alive）+ 结束响应头的空行
+def build_head_suffix(keep_alive):
+    res_header = ''
+    if keep_alive:
+        res_header += 'Connection: keep-alive\r\n'
+        res_header += 'Keep-Alive: timeout=%d, max=%d\r\n' % (KEEP_ALIVE_TIMEOUT, MAX_KEEP_ALIVE_REQUESTS)
+    else:
+        res_header += 'Connection: close\r\n'
+    res_header += '\r\n'                                  # 空行表示响应头结束
+    return res_header.encode()
+
+# 构造完整的响应头（状态行 + 响应头 + 空行）
+def build_response_head(status, headers, content_length, keep_alive):
+    return build_head_prefix(status, headers, content_length) + build_head_suffix(keep_alive)
+
+# 准备好的响应：状态、响应头和响应体。处理逻辑只负责生成Response，
+# 由线程模式的send_prepared或asyncio模式的async_send_prepared负责发送，两种模式共用同一套语义
+class Response:
+    def __init__(self, status, headers=None, body=b'', head_prefix=None, file=None):
+        self.status = status
+        self.headers = headers
+        self.body = body                # bytes，或由bytes和 (文件对象, 偏移, 长度) 组成的列表
+        self.head_prefix = head_prefix  # 缓存命中时预先构造好的响应头前缀
+        self.file = file                # 发送完后需要关闭的文件
+
+    def content_length(self):
+        if isinstance(self.body, bytes):
+            return len(self.body)
+        return sum(len(part) if isinstance(part, bytes) else part[2] for part in self.body)
+
+    def head(self, keep_alive):
+        if self.head_prefix is not None:
+            return self.head_prefix + build_head_suffix(keep_alive)
+        return build_response_head(self.status, self.headers, self.content_length(), keep_alive)
+
+    def parts(self):
+        return [self.body] if isinstance(self.body, bytes) else self.body
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+# 发送准备好的响应。文件部分用sendfile直接从页缓存发到套接字，不经过用户态的拷贝
+def send_prepared(tcp_socket, response, keep_alive):
+    head = response.head(keep_alive)
+    server_stats.record_response(response.status, len(head) + response.content_length())
+    if isinstance(response.body, bytes) and len(response.body) <= 65536:
+        tcp_socket.sendall(head + response.body)   # 小响应一次性发送响应头和响应体
+        return
+    tcp_socket.sendall(head, MSG_MORE)
+    for part in response.parts():
+        if isinstance(part, bytes):
+            tcp_socket.sendall(part)
+        else:
+            f, offset, count = part
+            if count > 0:                                 # count为0时sendfile会发送整个文件
+                tcp_socket.sendfile(f, offset, count)     # 零拷贝发送文件内容
+
+# 发送一个完整的HTTP响应。body可以是bytes，也可以是由bytes和 (文件对象, 偏移, 长度) 组成的列表
+def send_response(tcp_socket, status, headers=None, body=b'', keep_alive=False):
+    send_prepared(tcp_socket, Response(status, headers, body), keep_alive)
+
+# 从连接中读出下一个请求头。parser.buffer保存已经收到但还没处理的字节，
+# 请求体和流水线（pipelining）发送的下一个请求都留在里面。客户端关闭了连接时返回None
+def read_request(tcp_socket, parser):
+    while True:
+        request = parser.next_request()   # 格式错误或超过大小限制时抛出HTTPParseError
+        if request is not None:
+            return request
+        chunk = tcp_socket.recv(65536)
+        if not chunk:
+            if parser.has_partial():
+                raise HTTPParseError("Incomplete request")
+            return None
+        parser.feed(chunk)
+
+# PUT上传参数
+UPLOAD_BUFFER_SIZE = 256 * 1024  # 每次recv_into的最大字节数
+MAX_UPLOAD_SIZE = None           # 上传文件的最大字节数，None表示不限制
+MAX_CHUNK_LINE = 4096            # 分块编码中块大小行的最大长度
+
+upload_buffers = threading.local()   # 每个线程一个可重复使用的接收缓冲区，避免每次上传都重新分配
+
+def get_upload_buffer():
+    buf = getattr(upload_buffers, 'buf', None)
+    if buf is None:
+        buf = upload_buffers.buf = memoryview(bytearray(UPLOAD_BUFFER_SIZE))
+    return buf
+
+# 从套接字读取恰好length字节并写入文件f：先用buffer里已经收到的部分，再用recv_into直接收进复用的缓冲区，
+# 不拼接bytes，内存占用与上传大小无关
+def copy_body_to_file(tcp_socket, buffer, f, length):
+    if buffer:
+        take = min(len(buffer), length)
+        f.write(buffer[:take])
+        del buffer[:take]
+        length -= take
+    view = get_upload_buffer()
+    while length > 0:  # 循环直到接收足够长度的数据。
+        n = tcp_socket.recv_into(view, min(len(view), length))   # 不多读，后面的字节属于下一个请求
+        if n == 0:
+            raise ValueError("Connection closed before request body was complete")
+        f.write(view[:n])
+        length -= n
+
+# 读取一行（到CRLF为止），用于分块编码的块大小行和trailer
+def read_line(tcp_socket, buffer):
+    while True:
+        end = buffer.find(b'\r\n')
+        if end >= 0:
+            line = bytes(buffer[:end])
+            del buffer[:end + 2]
+            return line
+        if len(buffer) > MAX_CHUNK_LINE:
+            raise ValueError("Chunk line too long")
+        chunk = tcp_socket.recv(65536)
+        if not chunk:
+            raise ValueError("Connection closed before request body was complete")
+        buffer += chunk
+
+# 读取分块编码（Transfer-Encoding: chunked）的请求体并写入文件，返回总字节数
+def copy_chunked_body_to_file(tcp_socket, buffer, f):
+    total = 0
+    while True:
+        size_line = read_line(tcp_socket, buffer).split(b';', 1)[0].strip()   # 忽略块扩展
+        size = int(size_line, 16)                 # 块大小是十六进制，格式错误时抛出ValueError
+        if size == 0:
+            break
+        total += size
+        if MAX_UPLOAD_SIZE is not None and total > MAX_UPLOAD_SIZE:
+            raise ValueError("Upload too large")
+        copy_body_to_file(tcp_socket, buffer, f, size)
+        if read_line(tcp_socket, buffer) != b'':  # 每个块后面紧跟CRLF
+            raise ValueError("Malformed chunk")
+    while read_line(tcp_socket, buffer) != b'':   # 跳过trailer，直到空行
+        pass
+    return total
+
+# 热点文件缓存：保存可以直接发送的响应（响应头前缀 + 文件内容），按总字节数限制大小，LRU淘汰。
+# 每次命中前用stat比较修改时间和大小，文件在服务器之外被修改也不会返回旧内容
+class ResponseCache:
+    def __init__(self, max_bytes, max_entry_bytes=1024 * 1024):
+        self.max_bytes = max_bytes              # 缓存总预算（字节）
+        self.max_entry_bytes = max_entry_bytes  # 超过这个大小的文件不缓存，直接sendfile
+        self.entries = OrderedDict()            # 文件名 -> (mtime_ns, size, 响应头前缀, 文件内容)，越靠后越新
+        self.current_bytes = 0
+        self.lock = threading.Lock()            # 多个工作线程共享同一个缓存
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(filename):
+        return os.path.normpath(filename)       # "a.html" 和 "./a.html" 是同一个文件
+
+    def get(self, filename, st):
+        # 命中时返回 (响应头前缀, 文件内容)，否则返回None
+        key = self.key(filename)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0], entry[1]) != (st.st_mtime_ns, st.st_size):
+                self.remove(key)                # 文件已经变化，旧的缓存作废
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)       # 标记为最近使用
+            self.hits += 1
+            return entry[2], entry[3]
+
+    def put(self, filename, st, head_prefix, body):
+        size = len(head_prefix) + len(body)
+        if size > self.max_entry_bytes or size > self.max_bytes:
+            return
+        key = self.key(filename)
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (st.st_mtime_ns, st.st_size, head_prefix, body)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:   # 超出预算，淘汰最久未使用的条目
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, filename):
+        # PUT/DELETE修改文件后立即调用
+        with self.lock:
+            if self.remove(self.key(filename)):
+                self.invalidations += 1
+
+    def remove(self, key):
+        # 调用者必须持有锁
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.current_bytes -= len(entry[2]) + len(entry[3])
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
 
+response_cache = None   # 全局的热点文件缓存，默认关闭，由enable_response_cache开启
+
+# 开启热点文件缓存，max_bytes为总字节预算
+def enable_response_cache(max_bytes, max_entry_bytes=1024 * 1024):
+    global response_cache
+    response_cache = ResponseCache(max_bytes, max_entry_bytes)
+    return response_cache
+
+# 根据文件的stat信息生成校验器：ETag由修改时间和大小组成，文件内容变化时两者至少有一个会变。
+# 压缩后的内容是不同的表示，ETag带上编码名，避免和原文件的ETag混淆
+def make_etag(st, encoding=None):
+    if encoding:
+        return '"%x-%x-%s"' % (st.st_mtime_ns, st.st_size, encoding)
+    return '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+
+# 响应压缩参数
+COMPRESSION_ENABLED = True          # 是否根据Accept-Encoding压缩响应
+MIN_COMPRESS_SIZE = 1024            # 小于这个大小的文件压缩收益太小，直接发送原文件
+MAX_COMPRESS_SIZE = 16 * 1024 * 1024   # 超过这个大小的文件不压缩，直接sendfile
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+def compressible(content_type):
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+# 根据Accept-Encoding选择压缩方式，返回'gzip'、'deflate'或None（不压缩）
+def negotiate_encoding(accept_encoding):
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in ('gzip', 'deflate'):   # 权重相同时优先gzip
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+# 压缩后的内容缓存：同一个文件只在第一次请求（或文件修改后）压缩一次。
+# 键包含修改时间和大小，文件变化后旧的压缩结果自然不会再命中，最终被LRU淘汰
+class CompressedCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # (文件名, mtime_ns, size, 编码) -> 压缩后的字节
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename, st, encoding):
+        key = (os.path.normpath(filename), st.st_mtime_ns, st.st_size, encoding)
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, filename, st, encoding, body):
+        if len(body) > self.max_bytes:
+            return
+        key = (os.path.normpath(filename), st.st_mtime_ns, st.st_size, encoding)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self.entries[key] = body
+            self.current_bytes += len(body)
+            while self.current_bytes > self.max_bytes:
+                _, oldest = self.entries.popitem(last=False)
+                self.current_bytes -= len(oldest)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+compressed_cache = CompressedCache(32 * 1024 * 1024)   # 全局的压缩结果缓存，32MB
+
+# 读取并压缩文件，返回 (文件的stat, 压缩后的内容)
+def get_compressed(filename, encoding):
+    with open(filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        body = compressed_cache.get(filename, st, encoding)
+        if body is None:
+            data = f.read()
+            if encoding == 'gzip':
+                body = gzip.compress(data, compresslevel=6, mtime=0)   # mtime=0 让相同内容的压缩结果相同
+            else:
+                body = zlib.compress(data, 6)       # HTTP的deflate是带zlib头的格式
+            compressed_cache.put(filename, st, encoding, body)
+    return st, body
+
+# 判断客户端缓存的版本是否仍然有效（If-None-Match优先于If-Modified-Since）
+def not_modified(headers, st, etag):
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # GET使用弱比较，忽略W/前缀
+        candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return etag in candidates
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False                                  # 日期格式错误时忽略该请求头
+        return int(st.st_mtime) <= since                  # HTTP日期只精确到秒
+    return False
+
+# 文件的校验相关响应头
+def validator_headers(st, etag):
+    return [('Last-Modified', formatdate(st.st_mtime, usegmt=True)), ('ETag', etag)]
+
+MAX_RANGES = 16   # 一个请求最多允许的区间数，超过时忽略Range头，返回完整文件
+
+# 解析Range请求头，返回 [(起始, 结束), ...]（闭区间）。
+# 请求头格式不对或区间太多时返回None（忽略Range），所有区间都无法满足时返回空列表（回复416）
+def parse_range(range_header, size):
+    unit, sep, specs = range_header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, sep, last = spec.partition('-')
+        if not sep:
+            return None
+        try:
+            if not first:                          # bytes=-500 表示最后500字节
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(0, size - suffix), size - 1
+            else:                                  # bytes=100-199 或 bytes=100-
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None                    # 语法错误的区间
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:                           # 起点超出文件大小的区间无法满足
+            ranges.append((start, end))
+    return ranges
+
+# If-Range：客户端已有部分内容时带上它的校验器，只有文件没变才返回部分内容，否则返回完整文件
+def if_range_matches(headers, st, etag):
+    if_range = headers.get('if-range')
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag                    # 强比较，弱校验器永远不匹配
     try:
-        # 从客户端接收并解码HTTP请求
-        data = tcp_socket.recv(2048).decode()   # 从TCP套接字接收最多2048字节数据，并将其解码为UTF-8字符串。
-
-        # 打印完整的请求数据
-        print("Full Request:")   # 打印消息，表示下面将显示完整的HTTP请求内容。
-        print(data)              # 打印接收到的HTTP请求。
-        # 解析请求以提取请求的文件名和HTTP方法
-        request_lines = data.splitlines()   # 将接收到的数据按换行符分割成多行。
-
-        if request_lines:                   # 如果请求行列表不为空。
-            request_line = request_lines[0]  # 获取请求的第一行。
-            # 它将第一行按空格分割成单词列表，以获取HTTP方法和请求的文件名。同时，它去除文件名开头的斜杠。
-            words = request_line.split()     # 将请求行按空格分割成单词列表。
-
-            if len(words) >= 2:              # 如果分割后的单词数量不少于2个。
-                http_method = words[0]       # 获取请求的HTTP方法（如GET, POST）。
-
-                # GET / index.html HTTP / 1.1
-
-                filename = words[1].lstrip("/")  # 获取请求的文件名，去除开头的斜杠。
-                print(f"HTTP Method: {http_method}")
-                print(f"Requested file: {filename}")  # 打印HTTP方法和请求的文件名。
-
-                # 处理GET请求
-                if http_method == "GET":
-                    with open(filename, 'rb') as f:
-                    # 以二进制读模式打开文件，以原始字节返回给客户端，避免不正确的解码方法而使数据失真
-                        content = f.read().decode()   # 读取文件内容并解码为字符串。
-                    res_header = 'HTTP/1.1 200 OK\r\n\r\n'   # 创建HTTP响应头，状态码为200 OK。
-                    tcp_socket.send((res_header + content).encode())  # 将响应头和内容编码后发送给客户端。
-
-                # 处理PUT请求
-                elif http_method == "PUT":
-                    try:
-                        content_length = 0  # 初始化内容长度为0。
-
-                        # 在请求头中查找 'Content-Length' 字段
-                        for line in request_lines:
-                            if "Content-Length:" in line:# 检查每一行是否包含字符串 "Content-Length:"
-                                content_length = int(line.split(" ")[1])  # [1] 索引用于获取列表中的第二部分，即包含内容长度的部分。
-                                # 当找到包含 “Content-Length：” 的行时，使用 将行按空格分割，取第二部分，即内容长度的部分，并将其转换为整数。这将设置  变量为请求中指定的内容长度
-
-                        # 如果存在Content-Length，接收相应长度的数据
-                        if content_length > 0:
-                            received_data = b''  # 初始化接收数据的变量。字节串以 b 前缀开头，表示它是一个二进制数据序列。
-                            while len(received_data) < content_length:  # 循环直到接收足够长度的数据。
-                                chunk = tcp_socket.recv(2048)  # 接收数据。
-                                if not chunk:
-                                    break  # 如果没有接收到数据，则退出循环。
-                                received_data += chunk  # 将接收到的数据追加到变量中。
-
-                            # 将接收到的数据写入文件
-                            with open(filename, 'wb') as f:
-                                f.write(received_data)  # 以二进制写模式打开文件，并写入数据。
-
-                        # 构建成功响应的头部
-                        res_header = 'HTTP/1.1 200 OK\r\n'
-                        res_header += 'Content-Type: text/plain\r\n'
-                        res_header += '\r\n'
-                        tcp_socket.send(res_header.encode())  # 发送响应头给客户端。
-
-                    except Exception as e:
-                        print("Error while handling PUT request:", str(e))
-                        res_header = 'HTTP/1.1 500 INTERNAL SERVER ERROR\r\n\r\n'
-                        tcp_socket.send(res_header.encode())  # 发送500错误响应。
-
-                # 处理DELETE请求
-                elif http_method == "DELETE":
-                    # 实现DELETE请求的处理逻辑（例如删除文件）。
-                    try:
-                        os.remove(filename)  # 尝试删除指定的文件。
-                        res_header = 'HTTP/1.1 200 OK (DELETE request handled)\r\n\r\n'
-                        tcp_socket.send(res_header.encode())  # 发送成功响应。
-                    except FileNotFoundError:
-                        res_header = 'HTTP/1.1 404 NOT FOUND (File not found)\r\n\r\n'
-                        tcp_socket.send(res_header.encode())  # 发送404错误响应。
-
-                else:
-                    raise ValueError(f"Unsupported HTTP method: {http_method}")
+        return int(parsedate_to_datetime(if_range).timestamp()) == int(st.st_mtime)
+    except (TypeError, ValueError):
+        return False
+
+# 生成206部分内容的响应：单个区间直接发送，多个区间用multipart/byteranges；文件内容都按偏移用sendfile发送
+def range_response(f, st, ranges, content_type, res_headers):
+    size = st.st_size
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        res_headers = [('Content-Type', content_type), ('Content-Range', 'bytes %d-%d/%d' % (start, end, size))] + res_headers
+        return Response('206 PARTIAL CONTENT', res_headers, [(f, start, end - start + 1)], file=f)
+    boundary = uuid.uuid4().hex
+    body = []
+    for start, end in ranges:
+        part_header = '\r\n--' + boundary + '\r\n'
+        part_header += 'Content-Type: ' + content_type + '\r\n'
+        part_header += 'Content-Range: bytes %d-%d/%d\r\n' % (start, end, size)
+        part_header += '\r\n'
+        body.append(part_header.encode())
+        body.append((f, start, end - start + 1))
+    body.append(('\r\n--' + boundary + '--\r\n').encode())
+    res_headers = [('Content-Type', 'multipart/byteranges; boundary=' + boundary)] + res_headers
+    return Response('206 PARTIAL CONTENT', res_headers, body, file=f)
+
+# 生成GET请求的响应。这里会做阻塞的文件操作，asyncio模式下在线程池中调用
+def prepare_get(filename, headers):
+    # 先只做stat，客户端缓存仍然有效时直接回复304，不需要打开文件
+    st = os.stat(filename)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    # 选择压缩方式：只压缩可压缩的类型和合适大小的文件；Range请求按原文件的字节偏移处理，不压缩
+    encoding = None
+    vary = []
+    if COMPRESSION_ENABLED and compressible(content_type):
+        vary = [('Vary', 'Accept-Encoding')]   # 响应内容随Accept-Encoding变化，告诉中间缓存分开保存
+        if MIN_COMPRESS_SIZE <= st.st_size <= MAX_COMPRESS_SIZE and 'range' not in headers:
+            encoding = negotiate_encoding(headers.get('accept-encoding', ''))
+
+    etag = make_etag(st, encoding)
+    if not_modified(headers, st, etag):
+        return Response('304 NOT MODIFIED', validator_headers(st, etag) + vary)
+
+    if encoding is not None:
+        st, body = get_compressed(filename, encoding)
+        res_headers = [('Content-Type', content_type), ('Content-Encoding', encoding)] + vary
+        return Response('200 OK', res_headers + validator_headers(st, make_etag(st, encoding)), body)
+
+    # 断点续传/分段下载：带Range的请求直接按偏移从文件发送，不经过缓存
+    range_header = headers.get('range')
+    if range_header is not None and if_range_matches(headers, st, etag):
+        f = open(filename, 'rb')
+        st = os.fstat(f.fileno())
+        ranges = parse_range(range_header, st.st_size)
+        if ranges is not None:
+            res_headers = [('Accept-Ranges', 'bytes')] + validator_headers(st, make_etag(st)) + vary
+            if not ranges:
+                f.close()
+                return Response('416 RANGE NOT SATISFIABLE', [('Content-Range', 'bytes */%d' % st.st_size)] + res_headers)
+            return range_response(f, st, ranges, content_type, res_headers)
+        f.close()
+
+    cache = response_cache
+    if cache is not None:
+        cached = cache.get(filename, st)
+        if cached is not None:
+            # 缓存命中：不需要打开和读取文件
+            head_prefix, body = cached
+            return Response('200 OK', body=body, head_prefix=head_prefix)
+
+    f = open(filename, 'rb')
+    # 以二进制读模式打开文件，以原始字节返回给客户端，避免不正确的解码方法而使数据失真
+    try:
+        st = os.fstat(f.fileno())                         # 以打开的文件为准，避免stat之后文件被替换
+        res_headers = [('Content-Type', content_type), ('Accept-Ranges', 'bytes')] + validator_headers(st, make_etag(st)) + vary
+        if cache is not None and st.st_size <= cache.max_entry_bytes:
+            # 小文件读入内存并放进缓存，下次直接从内存发送
+            body = f.read(st.st_size)
+            if len(body) == st.st_size:                   # 读取过程中文件被截断时不缓存
+                head_prefix = build_head_prefix('200 OK', res_headers, len(body))
+                cache.put(filename, st, head_prefix, body)
+            f.close()
+            return Response('200 OK', res_headers, body)
+    except BaseException:
+        f.close()
+        raise
+    # 文件内容不读入内存，由sendfile从文件直接发送
+    return Response('200 OK', res_headers, [(f, 0, st.st_size)], file=f)
+
+# 处理GET请求
+def handle_get(tcp_socket, filename, headers, keep_alive):
+    response = prepare_get(filename, headers)
+    try:
+        send_prepared(tcp_socket, response, keep_alive)
+    finally:
+        response.close()
+
+# 上传前检查请求能否被接受，返回错误状态，没有问题时返回None。
+# 这些检查不需要请求体，带Expect: 100-continue的客户端在被拒绝时不会发送请求体
+def check_put(filename, headers):
+    transfer_encoding = headers.get('transfer-encoding', '').lower()
+    if transfer_encoding and transfer_encoding != 'chunked':
+        return '501 NOT IMPLEMENTED'
+    if not transfer_encoding:
+        content_length = int(headers.get('content-length', 0))   # 格式错误时抛出ValueError，回复400
+        if content_length < 0:
+            raise ValueError("Negative Content-Length")
+        if MAX_UPLOAD_SIZE is not None and content_length > MAX_UPLOAD_SIZE:
+            return '413 PAYLOAD TOO LARGE'
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not filename or not os.path.isdir(directory) or os.path.isdir(filename):
+        return '404 NOT FOUND'
+    return None
+
+# 在目标文件所在目录创建上传用的临时文件，返回 (文件对象, 临时文件路径)
+def create_upload_file(filename):
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename) + '.', suffix='.part')
+    return os.fdopen(fd, 'wb'), temp_path
+
+# 上传完成：用临时文件原子地替换目标文件，并清除缓存
+def commit_upload(temp_path, filename):
+    try:
+        mode = os.stat(filename).st_mode & 0o777  # 保留原文件的权限
+    except FileNotFoundError:
+        mode = 0o644
+    os.chmod(temp_path, mode)                     # mkstemp创建的文件权限是0600
+    os.replace(temp_path, filename)               # 原子替换
+    if response_cache is not None:
+        response_cache.invalidate(filename)       # 文件内容已变，立即清除缓存
+
+# 上传失败，删除临时文件
+def discard_upload(temp_path):
+    try:
+        os.unlink(temp_path)
+    except FileNotFoundError:
+        pass
+
+# 处理PUT请求，返回处理完后是否继续保持连接。
+# 请求体以流的方式写入同目录下的临时文件，接收完整后再原子地替换目标文件：
+# 上传中断时旧文件保持不变，其他请求也不会读到写了一半的文件
+def handle_put(tcp_socket, filename, headers, buffer, keep_alive):
+    expect_continue = headers.get('expect', '').lower() == '100-continue'
+    error = check_put(filename, headers)
+    if error is not None:
+        # 请求体没有读取，无法确定下一个请求从哪里开始，只能关闭连接
+        send_response(tcp_socket, error)
+        return False
+    if expect_continue:
+        tcp_socket.sendall(b'HTTP/1.1 100 Continue\r\n\r\n')   # 通知客户端开始发送请求体
+
+    temp_path = None
+    try:
+        f, temp_path = create_upload_file(filename)
+        with f:
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                copy_chunked_body_to_file(tcp_socket, buffer, f)
             else:
-                raise ValueError("Malformed request line")  # 如果请求行格式错误，则抛出异常。
+                copy_body_to_file(tcp_socket, buffer, f, int(headers.get('content-length', 0)))
+        commit_upload(temp_path, filename)
+        temp_path = None
+    except OSError as e:
+        if isinstance(e, (socket.timeout, ConnectionError)):
+            raise                                     # 网络错误交给handle_request关闭连接
+        print("Error while handling PUT request:", str(e))
+        send_response(tcp_socket, '500 INTERNAL SERVER ERROR')  # 发送500错误响应。
+        return False
+    finally:
+        if temp_path is not None:
+            discard_upload(temp_path)                 # 上传失败，删除临时文件
+
+    # 构建成功响应的头部
+    send_response(tcp_socket, '200 OK', [('Content-Type', 'text/plain')], keep_alive=keep_alive)
+    return keep_alive
+
+# 删除文件，返回响应状态
+def delete_file(filename):
+    try:
+        os.remove(filename)  # 尝试删除指定的文件。
+    except FileNotFoundError:
+        return '404 NOT FOUND (File not found)'
+    if response_cache is not None:
+        response_cache.invalidate(filename)   # 文件已删除，立即清除缓存
+    return '200 OK (DELETE request handled)'
+
+# 处理DELETE请求
+def handle_delete(tcp_socket, filename, keep_alive):
+    send_response(tcp_socket, delete_file(filename), keep_alive=keep_alive)
+
+# 处理连接上的一个请求，返回处理完后是否继续保持连接
+def handle_one_request(tcp_socket, request, buffer, last_request):
+    # 打印完整的请求数据（只在需要时才解码）
+    if LOG_REQUESTS:
+        log("Full Request:")   # 打印消息，表示下面将显示完整的HTTP请求内容。
+        log(request.raw.decode('latin-1'))   # 打印接收到的HTTP请求头。
+    server_stats.add('requests')
+
+    keep_alive = False
+    try:
+        # 从请求中取出文件名和HTTP方法
+        http_method = request.method
+        filename = request.target.lstrip("/")   # 获取请求的文件名，去除开头的斜杠。
+        headers = request.headers               # 按名字查找时不区分大小写
+        # 达到请求数上限或服务器正在停止时，本次响应后关闭连接
+        keep_alive = request.keep_alive() and not last_request and not shutdown_event.is_set()
+        log(f"HTTP Method: {http_method}")
+        log(f"Requested file: {filename}")  # 打印HTTP方法和请求的文件名。
+
+        if http_method == "GET":
+            handle_get(tcp_socket, filename, headers, keep_alive)
+        elif http_method == "PUT":
+            keep_alive = handle_put(tcp_socket, filename, headers, buffer, keep_alive)
+        elif http_method == "DELETE":
+            handle_delete(tcp_socket, filename, keep_alive)
         else:
-            raise ValueError("Empty request")  # 如果请求为空，则抛出异常。
+            raise ValueError(f"Unsupported HTTP method: {http_method}")
+
+    except ValueError as ve:
+        print("Error: ", ve)                           # 打印错误信息。
+        # 请求格式错误时无法确定下一个请求从哪里开始，只能关闭连接
+        send_response(tcp_socket, getattr(ve, 'status', '400 BAD REQUEST'))   # 发送400错误响应。
+        return False
+
+    except (socket.timeout, ConnectionError):
+        raise                                          # 网络错误交给handle_request关闭连接
 
     except IOError:
         # 处理文件未找到的情况，响应404错误
-        res_header = 'HTTP/1.1 404 NOT FOUND\r\n\r\n'  # 创建404错误的响应头。
-        tcp_socket.send(res_header.encode())           # 发送响应头给客户端。
-        print(res_header)                              # 打印响应头。
+        send_response(tcp_socket, '404 NOT FOUND', keep_alive=keep_alive)   # 发送404响应。
+        log('HTTP/1.1 404 NOT FOUND')                  # 打印响应状态。
 
-    except ValueError as ve:
-        print("Error: ", ve)                           # 打印错误信息。
-        res_header = 'HTTP/1.1 400 BAD REQUEST\r\n\r\n'  # 创建400错误的响应头。
-        tcp_socket.send(res_header.encode())             # 发送响应头给客户端。
+    return keep_alive
+
+# 定义处理客户端连接的函数，将在独立线程上运行。
+# 同一个连接上可以依次处理多个请求（持久连接），流水线发来的请求按到达顺序逐个响应
+def handle_request(tcp_socket):
+    log('Waiting for connection...')   # 打印信息，表示服务器正在等待连接。
+    tcp_socket.settimeout(KEEP_ALIVE_TIMEOUT)   # 空闲超时：在此时间内没有收到数据就放弃该连接
+    parser = RequestParser(max_header_bytes=MAX_HEADER_SIZE)   # 请求头解析器，parser.buffer是已接收但未处理的数据
+    served = 0              # 该连接上已处理的请求数
+    server_stats.add('connections')
+    server_stats.add('active_connections')
+
+    try:
+        keep_alive = True
+        while keep_alive:
+            try:
+                request = read_request(tcp_socket, parser)
+            except HTTPParseError as e:
+                print("Error: ", e)
+                send_response(tcp_socket, e.status)
+                break
+            if request is None:     # 客户端关闭了连接
+                break
+            served += 1
+            keep_alive = handle_one_request(tcp_socket, request, parser.buffer, served >= MAX_KEEP_ALIVE_REQUESTS)
+
+    except socket.timeout:
+        log("Connection idle timeout")   # 空闲超时，关闭连接
+
+    except OSError as err:
+        log("Connection error:", err)    # 客户端异常断开
 
     finally:
         tcp_socket.close()   # 关闭客户端套接字。
+        server_stats.add('active_connections', -1)
 
-# 定义启动服务器的函数
-def start_server(server_address, server_port):
+# ---------------- asyncio模式 ----------------
+# 与上面的线程模式处理相同的GET/PUT/DELETE语义，但所有连接都在一个事件循环线程上处理，
+# 空闲或很慢的连接只占用一个协程，不占用线程；阻塞的文件操作交给线程池执行
+
+# 发送准备好的响应，文件部分用loop.sendfile发送
+async def async_send_prepared(writer, response, keep_alive):
+    loop = asyncio.get_running_loop()
+    head = response.head(keep_alive)
+    server_stats.record_response(response.status, len(head) + response.content_length())
+    writer.write(head)
+    for part in response.parts():
+        if isinstance(part, bytes):
+            writer.write(part)
+        else:
+            f, offset, count = part
+            if count > 0:
+                await writer.drain()                       # sendfile之前必须先把缓冲区里的数据发完
+                await loop.sendfile(writer.transport, f, offset, count)
+    await writer.drain()
+
+async def async_send_response(writer, status, headers=None, body=b'', keep_alive=False):
+    await async_send_prepared(writer, Response(status, headers, body), keep_alive)
+
+# 从流中读取恰好length字节写入文件，每次读取都有超时，防止客户端故意慢速发送占住连接
+async def async_copy_body_to_file(reader, f, length):
+    loop = asyncio.get_running_loop()
+    while length > 0:
+        data = await asyncio.wait_for(reader.read(min(UPLOAD_BUFFER_SIZE, length)), BODY_READ_TIMEOUT)
+        if not data:
+            raise ValueError("Connection closed before request body was complete")
+        await loop.run_in_executor(None, f.write, data)
+        length -= len(data)
+
+async def async_read_line(reader):
+    return await asyncio.wait_for(reader.readline(), BODY_READ_TIMEOUT)   # 超过limit时抛出ValueError
+
+# 读取分块编码的请求体并写入文件
+async def async_copy_chunked_body_to_file(reader, f):
+    total = 0
+    while True:
+        size_line = (await async_read_line(reader)).split(b';', 1)[0].strip()   # 忽略块扩展
+        size = int(size_line, 16)
+        if size == 0:
+            break
+        total += size
+        if MAX_UPLOAD_SIZE is not None and total > MAX_UPLOAD_SIZE:
+            raise ValueError("Upload too large")
+        await async_copy_body_to_file(reader, f, size)
+        if await async_read_line(reader) != b'\r\n':   # 每个块后面紧跟CRLF
+            raise ValueError("Malformed chunk")
+    while True:                                          # 跳过trailer，直到空行
+        line = await async_read_line(reader)
+        if line in (b'\r\n', b''):
+            break
+    return total
+
+# asyncio模式的PUT，流程与handle_put相同
+async def async_handle_put(reader, writer, filename, headers, keep_alive):
+    loop = asyncio.get_running_loop()
+    error = await loop.run_in_executor(None, check_put, filename, headers)
+    if error is not None:
+        await async_send_response(writer, error)
+        return False
+    if headers.get('expect', '').lower() == '100-continue':
+        writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        await writer.drain()
+
+    temp_path = None
+    try:
+        f, temp_path = await loop.run_in_executor(None, create_upload_file, filename)
+        try:
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                await async_copy_chunked_body_to_file(reader, f)
+            else:
+                await async_copy_body_to_file(reader, f, int(headers.get('content-length', 0)))
+        finally:
+            await loop.run_in_executor(None, f.close)
+        await loop.run_in_executor(None, commit_upload, temp_path, filename)
+        temp_path = None
+    except OSError as e:
+        if isinstance(e, (TimeoutError, ConnectionError)):
+            raise
+        print("Error while handling PUT request:", str(e))
+        await async_send_response(writer, '500 INTERNAL SERVER ERROR')
+        return False
+    finally:
+        if temp_path is not None:
+            await loop.run_in_executor(None, discard_upload, temp_path)
+
+    await async_send_response(writer, '200 OK', [('Content-Type', 'text/plain')], keep_alive=keep_alive)
+    return keep_alive
+
+# asyncio模式下处理连接上的一个请求，返回处理完后是否继续保持连接
+async def async_handle_one_request(reader, writer, request, last_request):
+    loop = asyncio.get_running_loop()
+    if LOG_REQUESTS:
+        log("Full Request:")
+        log(request.raw.decode('latin-1'))
+    server_stats.add('requests')
+
+    keep_alive = False
+    try:
+        http_method = request.method
+        filename = request.target.lstrip("/")
+        headers = request.headers
+        keep_alive = request.keep_alive() and not last_request and not shutdown_event.is_set()
+        log(f"HTTP Method: {http_method}")
+        log(f"Requested file: {filename}")
+
+        if http_method == "GET":
+            response = await loop.run_in_executor(None, prepare_get, filename, headers)
+            try:
+                await async_send_prepared(writer, response, keep_alive)
+            finally:
+                response.close()
+        elif http_method == "PUT":
+            keep_alive = await async_handle_put(reader, writer, filename, headers, keep_alive)
+        elif http_method == "DELETE":
+            status = await loop.run_in_executor(None, delete_file, filename)
+            await async_send_response(writer, status, keep_alive=keep_alive)
+        else:
+            raise ValueError(f"Unsupported HTTP method: {http_method}")
+
+    except ValueError as ve:
+        print("Error: ", ve)
+        await async_send_response(writer, getattr(ve, 'status', '400 BAD REQUEST'))
+        return False
+
+    except (TimeoutError, ConnectionError):
+        raise
+
+    except IOError:
+        await async_send_response(writer, '404 NOT FOUND', keep_alive=keep_alive)
+        log('HTTP/1.1 404 NOT FOUND')
+
+    return keep_alive
+
+# asyncio模式的连接处理。读取请求头有总的截止时间（包括等待下一个请求的空闲时间），
+# 一个字节一个字节慢慢发送请求头的客户端（slowloris）也会在超时后被断开
+async def async_handle_connection(reader, writer):
+    log('Connection established with: %s' % str(writer.get_extra_info('peername')))
+    served = 0
+    server_stats.add('connections')
+    server_stats.add('active_connections')
+    try:
+        keep_alive = True
+        while keep_alive:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+            except asyncio.IncompleteReadError as e:
+                if e.partial.strip():
+                    print("Error: ", "Incomplete request")
+                    await async_send_response(writer, '400 BAD REQUEST')
+                break                               # 客户端关闭了连接
+            except asyncio.LimitOverrunError:
+                print("Error: ", "Request header too large")
+                await async_send_response(writer, '431 REQUEST HEADER FIELDS TOO LARGE')
+                break
+            try:
+                request = parse_request_head(head[:-4])   # readuntil已经保证请求头完整
+            except HTTPParseError as e:
+                print("Error: ", e)
+                await async_send_response(writer, e.status)
+                break
+            served += 1
+            keep_alive = await async_handle_one_request(reader, writer, request, served >= MAX_KEEP_ALIVE_REQUESTS)
+
+    except TimeoutError:
+        log("Connection idle timeout")
+
+    except OSError as err:
+        log("Connection error:", err)
+
+    finally:
+        server_stats.add('active_connections', -1)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+# 在已监听的套接字上运行asyncio服务器，直到shutdown_event被设置
+async def serve_asyncio(server_socket, workers):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=workers))
+    server = await asyncio.start_server(async_handle_connection, sock=server_socket, limit=MAX_HEADER_SIZE)
+    # 轮询shutdown_event。不能在执行器线程里阻塞等待它：解释器退出时会等待执行器线程结束，
+    # 如果事件一直没有被设置，进程就无法退出
+    while not shutdown_event.is_set():
+        await asyncio.sleep(0.5)
+    server.close()                       # 停止接受新连接
+    await server.wait_closed()
+    # 等待正在处理的连接结束（它们在当前请求完成后会回复Connection: close）
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT
+    while server_stats.get('active_connections') > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+
+# 线程池满时的503响应
+def reject_busy(tcp_socket):
+    try:
+        send_response(tcp_socket, '503 SERVICE UNAVAILABLE', [('Retry-After', '1')])   # 告诉客户端1秒后重试
+    except OSError:
+        pass                                      # 客户端已断开，忽略
+    finally:
+        tcp_socket.close()
+
+# 固定大小的工作线程池，连接先进入有界队列，再由空闲的工作线程取出处理
+class WorkerPool:
+    def __init__(self, workers, queue_size):
+        self.connections = queue.Queue(maxsize=queue_size)   # 有界队列，满了就说明服务器已饱和
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        while True:
+            connection_socket = self.connections.get()   # 阻塞等待新的连接
+            if connection_socket is None:                # None是停止信号
+                break
+            handle_request(connection_socket)
+
+    def submit(self, connection_socket, block=False):
+        # 把连接放入队列。block=False时队列满立即返回False，由调用者做背压处理
+        try:
+            self.connections.put(connection_socket, block=block)
+            return True
+        except queue.Full:
+            return False
+
+    def shutdown(self):
+        for _ in self.threads:
+            self.connections.put(None)   # 每个工作线程一个停止信号
+        for thread in self.threads:
+            thread.join()
+
+# 创建并监听服务器套接字
+def create_server_socket(server_address, server_port, backlog=128, reuse_port=False):
     TCP = socket.getprotobyname('tcp')   # 获取TCP协议的常量,增加可读性
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, TCP)
     #                                   创建IPv4, TCP的套接字对象。
@@ -117,28 +967,154 @@ def start_server(server_address, server_port):
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)   # 设置套接字选项，以便重用地址。
     #SOL_SOCKET套接字级别，影响套接字的一般行为。
     # 1表示启用socket.SO_REUSEADDR允许重用地址。这个选项告诉操作系统可以在服务器套接字关闭后立即重新绑定到之前使用的地址和端口，而不必等待一段时间
-    print("Server ready to serve...")   # 打印消息，表示服务器准备就绪。
+    if reuse_port:
+        # SO_REUSEPORT允许多个进程各自绑定同一个端口，由内核把新连接均匀分给它们
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     server_socket.bind((server_address, int(server_port)))   # 绑定服务器套接字到指定地址和端口。
-    server_socket.listen(128)   # 开始监听来自客户端的连接。
+    server_socket.listen(backlog)   # 开始监听来自客户端的连接。
     # 等待连接队列的最大长度。这个参数决定了服务器可以同时处理多少个等待连接的客户端。
+    return server_socket
 
-    while True:
+# 在已监听的套接字上循环接受连接，并按指定的并发模式分发。设置shutdown_event或关闭server_socket即可让循环退出。
+def serve_forever(server_socket, mode=SERVER_MODE_THREAD, workers=32, queue_size=128, overload=OVERLOAD_REJECT):
+    if mode == SERVER_MODE_ASYNCIO:
+        asyncio.run(serve_asyncio(server_socket, workers))   # 单线程事件循环，workers为文件操作线程数
+        return
+
+    pool = None
+    if mode == SERVER_MODE_POOL:
+        pool = WorkerPool(workers, queue_size)   # 线程池模式：预先创建固定数量的工作线程
+    elif mode != SERVER_MODE_THREAD:
+        raise ValueError(f"Unsupported server mode: {mode}")
+
+    server_socket.settimeout(1)   # accept每秒超时一次，检查是否需要停止
+    while not shutdown_event.is_set():
         try:
-            connection_socket, client_addr = server_socket.accept()   # 接受一个客户端连接。
+            try:
+                connection_socket, client_addr = server_socket.accept()   # 接受一个客户端连接。
+            except socket.timeout:
+                continue
+            log("Connection established with: %s" % str(client_addr))   # 打印客户端连接信息。
 
-            # 为客户端请求创建一个新线程
-            # target指定了线程要运行的函数
-            # args参数传递了connection_socket，即客户端连接的套接字
-            thread = threading.Thread(target=handle_request, args=(connection_socket,))   # 创建一个新线程。
-            print("Connection established with: %s" % str(client_addr))   # 打印客户端连接信息。
-            thread.start()   # 启动线程处理客户端请求。
+            if pool is None:
+                # 为客户端请求创建一个新线程
+                # target指定了线程要运行的函数
+                # args参数传递了connection_socket，即客户端连接的套接字
+                thread = threading.Thread(target=handle_request, args=(connection_socket,))   # 创建一个新线程。
+                thread.start()   # 启动线程处理客户端请求。
+            elif not pool.submit(connection_socket, block=(overload == OVERLOAD_WAIT)):
+                reject_busy(connection_socket)   # 队列已满：回复503，避免无限堆积
 
         except Exception as err:
             print(err)   # 打印任何异常信息。
             break
 
+    if pool is not None:
+        pool.shutdown()   # 等待工作线程处理完队列中剩余的连接
+
+# ---------------- 多进程（prefork）模式 ----------------
+# 一个Python进程受GIL限制只能用满一个CPU核。prefork模式启动多个工作进程，每个进程运行上面的某种并发模式；
+# 主进程只负责监督：工作进程异常退出时重新启动，收到停止信号时通知所有工作进程平滑退出，并汇总统计
+
+# 工作进程的入口
+def prefork_worker(index, server_address, server_port, shared_socket, counters, mode, workers, queue_size, overload,
+                   cache_bytes):
+    global server_stats
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_event.set())   # 主进程发来SIGTERM时平滑退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl+C由主进程统一处理
+    shutdown_event.clear()
+    server_stats = ServerStats(counters, index * len(STAT_FIELDS))   # 使用共享内存中属于自己的一段
+    if cache_bytes > 0:
+        enable_response_cache(cache_bytes)   # 每个进程有自己的缓存
+    if shared_socket is not None:
+        server_socket = shared_socket        # 不支持SO_REUSEPORT时，共享主进程创建的监听套接字
+    else:
+        server_socket = create_server_socket(server_address, server_port, reuse_port=True)
+    serve_forever(server_socket, mode, workers, queue_size, overload)
+    server_socket.close()
+
+# 汇总所有工作进程的统计
+def aggregate_stats(counters, processes):
+    total = dict.fromkeys(STAT_FIELDS, 0)
+    for index in range(processes):
+        for field, value in ServerStats(counters, index * len(STAT_FIELDS)).snapshot().items():
+            total[field] += value
+    return total
+
+# 以prefork模式启动服务器：processes个工作进程，主进程负责监督
+def start_prefork_server(server_address, server_port, processes=None, mode=SERVER_MODE_THREAD, workers=32,
+                         queue_size=128, overload=OVERLOAD_REJECT, cache_bytes=0):
+    processes = processes or os.cpu_count() or 1
+    ctx = multiprocessing.get_context('fork')   # 工作进程直接继承主进程的状态（仅Unix）
+    counters = ctx.Array('q', processes * len(STAT_FIELDS), lock=False)   # 共享内存中的统计计数器
+
+    shared_socket = None
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        shared_socket = create_server_socket(server_address, server_port)   # 退而求其次：所有进程共享同一个监听套接字
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <主进程> 打印当前的汇总统计
+        signal.signal(signal.SIGUSR1, lambda signum, frame: print("Server stats:", aggregate_stats(counters, processes)))
+
+    procs = [None] * processes
+    started = [0.0] * processes
+
+    def spawn(index):
+        # 重新启动的进程的活动连接数从0开始
+        counters[index * len(STAT_FIELDS) + STAT_FIELDS.index('active_connections')] = 0
+        proc = ctx.Process(target=prefork_worker, args=(index, server_address, server_port, shared_socket, counters,
+                                                        mode, workers, queue_size, overload, cache_bytes))
+        proc.start()
+        procs[index] = proc
+        started[index] = time.monotonic()
+
+    for index in range(processes):
+        spawn(index)
+    print("Server ready to serve with %d worker processes..." % processes)
+
+    while not stopping.is_set():
+        stopping.wait(0.5)
+        for index, proc in enumerate(procs):
+            if not stopping.is_set() and not proc.is_alive():
+                print("Worker %d (pid %d) exited with code %s, restarting" % (index, proc.pid, proc.exitcode))
+                proc.join()
+                if time.monotonic() - started[index] < 1:
+                    time.sleep(1)   # 启动后立即崩溃的进程稍等再重启，避免疯狂重启
+                spawn(index)
+
+    # 平滑退出：通知工作进程停止接受新连接，等待它们处理完正在进行的请求
+    print("Shutting down workers...")
+    for proc in procs:
+        if proc.is_alive():
+            proc.terminate()   # 发送SIGTERM
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+    for proc in procs:
+        proc.join(max(0, deadline - time.monotonic()))
+        if proc.is_alive():
+            proc.kill()        # 超时仍未退出的进程强制结束
+            proc.join()
+    if shared_socket is not None:
+        shared_socket.close()
+    print("Server stats:", aggregate_stats(counters, processes))
+
+# 定义启动服务器的函数
+def start_server(server_address, server_port, mode=SERVER_MODE_THREAD, workers=32, queue_size=128, overload=OVERLOAD_REJECT,
+                 cache_bytes=0):
+    if cache_bytes > 0:
+        enable_response_cache(cache_bytes)   # 开启热点文件缓存
+    server_socket = create_server_socket(server_address, server_port)
+    print("Server ready to serve...")   # 打印消息，表示服务器准备就绪。
+
+    serve_forever(server_socket, mode, workers, queue_size, overload)
+
     server_socket.close()   # 关闭服务器套接字。
+    if response_cache is not None:
+        print("Response cache stats:", response_cache.stats())   # 打印缓存命中统计，用于调整缓存大小
+    print("Server stats:", server_stats.snapshot())
 
 # 主程序入口
 if __name__ == "__main__":
@@ -147,4 +1123,16 @@ if __name__ == "__main__":
     if not server_port:
         server_port = 8000   # 如果用户未提供端口号，则使用默认值8000。
 
-    start_server(server_address, server_port)   # 使用指定的地址和端口启动服务器。
+    mode = input("Enter the server mode (thread, pool or asyncio) [default:thread]: ") or SERVER_MODE_THREAD
+    workers = 32
+    if mode in (SERVER_MODE_POOL, SERVER_MODE_ASYNCIO):
+        workers = int(input("Enter the number of worker threads [default:32]: ") or 32)
+
+    cache_mb = int(input("Enter the response cache size in MB (0 to disable) [default:0]: ") or 0)
+    processes = int(input("Enter the number of worker processes (1 = single process) [default:1]: ") or 1)
+
+    if processes > 1:
+        # 多进程模式，每个进程运行上面选择的并发模式
+        start_prefork_server(server_address, server_port, processes, mode, workers, cache_bytes=cache_mb * 1024 * 1024)
+    else:
+        start_server(server_address, server_port, mode, workers, cache_bytes=cache_mb * 1024 * 1024)   # 使用指定的地址和端口启动服务器。
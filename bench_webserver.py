@@ -0,0 +1,87 @@
+# WebServer并发模式压测：对比每连接一线程(thread)和固定线程池(pool)
+
+
+import socket                   # 导入 'socket' 模块，用于网络通信。
+import threading                # 导入 'threading' 模块，每个压测客户端一个线程。
+import time                     # 导入 'time' 模块，用于计时。
+import sys                      # 导入 'sys' 模块，读取命令行参数。
+
+import WebServer                # 被测的服务器模块
+
+
+# 在后台线程中启动服务器，返回 (服务器套接字, 端口号, 线程)
+def start_background_server(mode, workers, queue_size):
+    server_socket = WebServer.create_server_socket("127.0.0.1", 0, backlog=1024)   # 端口0表示由系统分配空闲端口
+    port = server_socket.getsockname()[1]
+    thread = threading.Thread(target=WebServer.serve_forever,
+                              args=(server_socket, mode, workers, queue_size), daemon=True)
+    thread.start()
+    return server_socket, port, thread
+
+# 单个客户端：顺序发送requests个GET请求，每个请求一个新连接，记录延迟和状态码
+def run_client(port, filename, requests, latencies, statuses, lock):
+    request = ('GET /' + filename + ' HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n').encode()
+    for _ in range(requests):
+        begin = time.perf_counter()
+        status = "error"
+        try:
+            client_socket = socket.create_connection(("127.0.0.1", port), timeout=10)
+            client_socket.sendall(request)
+            response = b''
+            while True:   # 读到服务器关闭连接为止
+                chunk = client_socket.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+            client_socket.close()
+            status = response.split(b' ', 2)[1].decode() if response else "empty"
+        except OSError:
+            pass   # 连接被拒绝或超时，计为error
+        elapsed = time.perf_counter() - begin
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+# 对一种模式做一轮压测并打印结果
+def bench(mode, clients, requests, filename, workers=32, queue_size=128, cache_bytes=0):
+    WebServer.response_cache = None
+    WebServer.shutdown_event.clear()
+    if cache_bytes > 0:
+        WebServer.enable_response_cache(cache_bytes)
+    server_socket, port, server_thread = start_background_server(mode, workers, queue_size)
+    latencies, statuses, lock = [], {}, threading.Lock()
+    threads = [threading.Thread(target=run_client, args=(port, filename, requests, latencies, statuses, lock))
+               for _ in range(clients)]
+
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+
+    WebServer.shutdown_event.set()   # asyncio模式通过shutdown_event停止，由事件循环关闭监听套接字
+    if mode != WebServer.SERVER_MODE_ASYNCIO:
+        server_socket.close()      # 关闭监听套接字，serve_forever的accept会抛出异常并退出
+    server_thread.join(timeout=5)
+
+    latencies.sort()
+    total = len(latencies)
+    p50 = latencies[total // 2] * 1000
+    p99 = latencies[min(total - 1, int(total * 0.99))] * 1000
+    name = mode + ('+cache' if cache_bytes else '')
+    print(f"[{name}] {clients} clients x {requests} requests: {total / elapsed:.0f} req/s, "
+          f"p50 {p50:.2f} ms, p99 {p99:.2f} ms, status {statuses}")
+
+if __name__ == "__main__":
+    # 用法: python bench_webserver.py [并发客户端数] [每客户端请求数] [文件名]
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    filename = sys.argv[3] if len(sys.argv) > 3 else "test1.html"
+
+    WebServer.LOG_REQUESTS = False   # 关闭逐请求打印，否则测的是终端输出速度
+    bench(WebServer.SERVER_MODE_THREAD, clients, requests, filename)
+    bench(WebServer.SERVER_MODE_POOL, clients, requests, filename)
+    bench(WebServer.SERVER_MODE_ASYNCIO, clients, requests, filename)
+    bench(WebServer.SERVER_MODE_POOL, clients, requests, filename, cache_bytes=16 * 1024 * 1024)
+    print("cache stats:", WebServer.response_cache.stats())
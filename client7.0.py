@@ -1,7 +1,22 @@
 # -*- coding: UTF-8 -*-
 import os               # Import the 'os' module for file operations.
+import sys              # Import the 'sys' module for exit codes.
+import json             # Import the 'json' module for writing benchmark results.
+import math             # Import the 'math' module for percentile ranks.
+import time             # Import the 'time' module for timing requests.
+import argparse         # Import the 'argparse' module for the command line options.
+import threading        # Import the 'threading' module for concurrent connections.
+import queue            # Import the 'queue' module to hand batch documents to the download workers.
+import zlib             # Import the 'zlib' module to decode gzip/deflate bodies while streaming.
+import tempfile         # Import the 'tempfile' module for a private partial file per download.
 import webbrowser       # Import the 'webbrowser' module for opening web pages.
-from socket import socket, AF_INET, SOCK_STREAM   # Import specific names from the 'socket' module.
+from socket import create_connection, IPPROTO_TCP, TCP_NODELAY   # Import specific names from the 'socket' module.
+from urllib.parse import urlsplit, urljoin   # Import URL helpers to take the host out of a proxied URL.
+from http_parser import ResponseParser, ChunkedDecoder, HTTPParseError   # The same incremental parser WebServer and the proxy use.
+
+# mkstemp creates 0600 files; saved downloads get the usual permissions (read once, before any threads start)
+UMASK = os.umask(0)
+os.umask(UMASK)
 
 # Function to get a valid port number from user input with a default value
 def get_valid_port(prompt, default):
@@ -19,54 +34,516 @@ def get_valid_port(prompt, default):
         except ValueError:
             print("Please enter a valid port number.")  # Print an error message for a non-integer input.
 
-while True:
-    # Let the user input the server port with a default value of 8000
-    server_port = get_valid_port("Enter the server port [default:8000]: ", 8000)
-
-    # Let the user input the object filename with a default value of test1.html
-    obj = input("Hello, which document do you want to query? (default: test1.html): ")
-    if not obj:
-        obj = "test1.html"   # Set a default object filename if no input is provided.
-
-    # Build a new client socket for each request
-    client_socket = socket(AF_INET, SOCK_STREAM)   # Create a new socket for IPv4, TCP communication.
-
-    # Build a connection to the server
-    client_socket.connect(("127.0.0.1", server_port))   # Connect to the server at IP 127.0.0.1 and the specified port.
-
-    # Write the GET header with additional headers similar to a browser
-    Head = 'GET /' + obj + ' HTTP/1.1\r\n'                  # Build the GET request header with the requested object.
-    Head += 'Host: 127.0.0.1:' + str(server_port) + '\r\n'  # Specify the host and port in the header.
-    # Add various HTTP headers to simulate a browser's request.
-    Head += 'Connection: close\r\n'
-    Head += 'User-Agent: Mozilla/5.0 (compatible; MyClient/0.1; +http://myclient.example.com)\r\n'
-    Head += 'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
-    Head += 'Accept-Language: en-US,en;q=0.5\r\n'
-    Head += 'Accept-Encoding: gzip, deflate, br\r\n'
-    Head += 'Upgrade-Insecure-Requests: 1\r\n'
-    Head += '\r\n'   # End of the request headers.
-
-    # Send the request using the socket
-    client_socket.send(Head.encode('utf-8'))   # Encode and send the HTTP request to the server.
-
-    # Get the message
-    recv_data = client_socket.recv(1024 * 1000).decode('utf-8')   # Receive and decode the server's response.
-
-    # Check for a 404 Not Found status in the response
-    if "404 NOT FOUND" in recv_data.splitlines()[0]:
-        print("Error: File not found (404)")   # Print an error message for a 404 status.
+# A client connection that can be reused for several keep-alive requests
+class ClientConnection:
+    """One TCP connection to the server; reconnects when the server closes it."""
+    def __init__(self, host, port, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None      # None until the first request (or after the server closed it).
+        self.parser = None    # Holds bytes received after the previous response.
+        self.buffer = bytearray(256 * 1024)   # Large receive buffer reused for every body read.
+        self.first_byte = None   # When the first response byte of the current request arrived.
+        self.current_head = None   # Head of the response being read.
+
+    def connect(self):
+        """Open the TCP connection and return the time it took in seconds."""
+        begin = time.perf_counter()
+        self.sock = create_connection((self.host, self.port), self.timeout)
+        self.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)   # Send small requests immediately.
+        self.parser = ResponseParser()
+        return time.perf_counter() - begin
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def request(self, raw_request, sink=None, method='GET'):
+        """Send one request and read the whole response.
+
+        Body bytes are passed to sink (if given) as they arrive. Returns
+        (response head, body bytes, (connect, ttfb, total) seconds); connect is
+        0 when an existing keep-alive connection was reused. ttfb and total are
+        measured from the start of the call, so they include connect time and
+        any retry.
+        """
+        reused = self.sock is not None
+        self.first_byte = None
+        started = time.perf_counter()
+        try:
+            return self.send_and_read(raw_request, sink, method, started)
+        except ConnectionError:
+            self.close()
+            if reused and self.first_byte is None:
+                return self.send_and_read(raw_request, sink, method, started)   # The idle connection was closed by the server; retry once.
+            raise
+        except (OSError, HTTPParseError):
+            self.close()
+            raise
+
+    def send_and_read(self, raw_request, sink, method, started):
+        connect_time = self.connect() if self.sock is None else 0.0
+        self.sock.sendall(raw_request)
+        while True:   # Read until a final (non-1xx) response head has arrived.
+            head = self.parser.next_response()
+            if head is None:
+                data = self.sock.recv(65536)
+                if not data:
+                    raise ConnectionError("Server closed the connection before the response")
+                if self.first_byte is None:
+                    self.first_byte = time.perf_counter()
+                self.parser.feed(data)
+            elif not 100 <= head.status < 200:
+                break
+        if self.first_byte is None:
+            self.first_byte = time.perf_counter()   # The head was already buffered from an earlier read.
+        self.current_head = head   # Lets a sink look at the headers (e.g. Content-Encoding) while the body streams.
+        body_bytes = self.read_body(head, sink, method)
+        done = time.perf_counter()
+        if not head.keep_alive():
+            self.close()   # The server will close its end; the next request opens a new connection.
+        return head, body_bytes, (connect_time, self.first_byte - started, done - started)
+
+    def read_body(self, head, sink, method):
+        """Read the body framed by Content-Length, chunked encoding or connection close."""
+        mode, length = head.framing(method)
+        pending = bytes(self.parser.buffer)   # Body bytes that arrived together with the head.
+        self.parser.buffer.clear()
+        view = memoryview(self.buffer)
+        total = 0
+        if mode == 'length':
+            if len(pending) > length:
+                self.parser.feed(pending[length:])   # Belongs to the next response.
+                pending = pending[:length]
+            total = len(pending)
+            if sink and pending:
+                sink(pending)
+            while total < length:
+                n = self.sock.recv_into(view, min(len(self.buffer), length - total))
+                if n == 0:
+                    raise ConnectionError("Server closed the connection in the middle of the body")
+                if sink:
+                    sink(view[:n])
+                total += n
+        elif mode == 'chunked':
+            decoder = ChunkedDecoder()
+            data = pending
+            while True:
+                chunk = decoder.feed(data)
+                total += len(chunk)
+                if sink and chunk:
+                    sink(chunk)
+                if decoder.done:
+                    break
+                n = self.sock.recv_into(view)
+                if n == 0:
+                    raise ConnectionError("Server closed the connection in the middle of the body")
+                data = view[:n]
+            self.parser.feed(bytes(decoder.buffer))
+        elif mode == 'close':
+            total = len(pending)
+            if sink and pending:
+                sink(pending)
+            while True:
+                n = self.sock.recv_into(view)
+                if n == 0:
+                    break
+                if sink:
+                    sink(view[:n])
+                total += n
+            self.close()
+        return total
+
+# Wrap sink so that a gzip or deflate encoded body is decompressed on the way to disk
+def decoding_sink(head, sink):
+    encoding = head.headers.get('content-encoding', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return sink, None
+    if encoding not in ('gzip', 'x-gzip', 'deflate'):
+        raise HTTPParseError("Unsupported Content-Encoding: " + encoding)
+    wbits = 16 + zlib.MAX_WBITS if 'gzip' in encoding else zlib.MAX_WBITS
+    decompressor = zlib.decompressobj(wbits)
+    return (lambda data: sink(decompressor.decompress(data))), lambda: sink(decompressor.flush())
+
+# Stream one document to path; the file only appears once the whole body arrived with status 200
+def download(conn, request, path):
+    """Send the raw request bytes on conn and return (status, bytes written, seconds)."""
+    # A unique partial file next to the target, so concurrent downloads of the same name never share one
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.part',
+                                     dir=os.path.dirname(path) or '.')
+    begin = time.perf_counter()
+    with os.fdopen(fd, 'wb') as f:
+        state = {}
+
+        def sink(data):
+            if 'write' not in state:   # First body bytes: the head is known, pick the decoder.
+                state['write'], state['flush'] = decoding_sink(conn.current_head, f.write)
+            state['write'](data)
+        try:
+            head, _, _ = conn.request(request, sink)
+            if 'write' not in state:   # Empty body.
+                state['write'], state['flush'] = decoding_sink(head, f.write)
+            if state['flush']:
+                state['flush']()
+        except BaseException:
+            f.close()
+            os.unlink(temp_path)
+            raise
+    if head.status == 200:
+        os.chmod(temp_path, 0o666 & ~UMASK)
+        os.replace(temp_path, path)
     else:
-        write_data = recv_data.splitlines()[4:]   # Extract the HTML content from the response.
+        os.unlink(temp_path)
+    return head.status, os.path.getsize(path) if head.status == 200 else 0, time.perf_counter() - begin
+
+# Parse a Content-Range header ("bytes first-last/size"); returns (first, last, size) or None
+def content_range(head):
+    unit, _, spec = head.headers.get('content-range', '').strip().partition(' ')
+    span, _, size = spec.partition('/')
+    first, _, last = span.partition('-')
+    try:
+        if unit.lower() == 'bytes':
+            return int(first), int(last), int(size)
+    except ValueError:
+        pass
+    return None
+
+# Stream one document as several byte ranges over separate connections into one partial file
+def segmented_download(conn, target, host_header, path, segments):
+    """Fetch target in `segments` Range requests and return (status, bytes written, seconds).
+
+    A one-byte probe on conn gives the size and validator; a server without
+    Range support answers it with the whole document, which is saved as is.
+    The rest is split into ranges fetched in parallel, the first on conn and
+    the others on new connections, each written at its own offset. If-Range
+    makes a changed document fail the download instead of mixing versions.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.part',
+                                     dir=os.path.dirname(path) or '.')
+    begin = time.perf_counter()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            head, _, _ = conn.request(build_request(target, host_header, True, byte_range=(0, 0)), f.write)
+            status, span = head.status, content_range(head)
+            if status == 206:
+                if span is None or span[:2] != (0, 0):
+                    raise HTTPParseError("Unexpected Content-Range in the probe: " + head.headers.get('content-range', ''))
+                f.truncate(span[2])
+        if status == 206:
+            validator = head.headers.get('etag', '')
+            if not validator or validator.startswith('W/'):   # If-Range needs a strong validator.
+                validator = head.headers.get('last-modified')
+            status = fetch_segments(conn, target, host_header, temp_path, span[2], validator, segments)
+        elif status == 416 and head.headers.get('content-range', '').strip() == 'bytes */0':
+            status = 200   # An empty document has no byte 0; the empty partial file is the result.
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    if status == 200:
+        os.chmod(temp_path, 0o666 & ~UMASK)
+        os.replace(temp_path, path)
+    else:
+        os.unlink(temp_path)
+    return status, os.path.getsize(path) if status == 200 else 0, time.perf_counter() - begin
+
+# Fetch bytes 1..size-1 of a document (byte 0 came with the probe) in parallel; returns 200 or the first failure
+def fetch_segments(conn, target, host_header, temp_path, size, validator, segments):
+    bounds = [1 + (size - 1) * i // segments for i in range(segments + 1)]
+    pieces = [(bounds[i], bounds[i + 1] - 1) for i in range(segments) if bounds[i] < bounds[i + 1]]
+    failures = []
+
+    def fetch(piece, piece_conn):
+        first, last = piece
+        request = build_request(target, host_header, True, byte_range=piece, if_range=validator)
+        try:
+            with open(temp_path, 'r+b') as f:   # Each segment has its own file position.
+                f.seek(first)
+                head, nbytes, _ = piece_conn.request(request, f.write)
+            if head.status != 206 or content_range(head) != (first, last, size) or nbytes != last - first + 1:
+                failures.append("error: bytes %d-%d answered %s %s" % (
+                    first, last, head.status, head.headers.get('content-range', '')))
+        except (OSError, HTTPParseError) as e:
+            failures.append('error: ' + str(e))
+        finally:
+            if piece_conn is not conn:
+                piece_conn.close()
+
+    threads = [threading.Thread(target=fetch, args=(piece, conn if i == 0 else ClientConnection(conn.host, conn.port, conn.timeout)))
+               for i, piece in enumerate(pieces)]   # The first segment reuses the probe's keep-alive connection.
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failures[0] if failures else 200
+
+# Fetch a list of documents concurrently over a small pool of reused keep-alive connections
+def run_batch(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    documents = queue.Queue()
+    for name in args.documents:
+        documents.put(name)
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        conn = ClientConnection(args.host, args.port, args.timeout)   # One connection per worker, reused for every document.
+        while True:
+            try:
+                name = documents.get_nowait()
+            except queue.Empty:
+                break
+            if args.url:   # Through the proxy: each document is a URL relative to --url.
+                target = urljoin(args.url, name)
+                host_header = urlsplit(target).netloc
+            else:
+                target = '/' + name.lstrip('/')
+                host_header = args.host + ':' + str(args.port)
+            path = os.path.join(args.output_dir, os.path.basename(urlsplit(target).path) or 'index.html')
+            try:
+                if args.segments > 1:
+                    status, nbytes, seconds = segmented_download(conn, target, host_header, path, args.segments)
+                else:
+                    request = build_request(target, host_header, True, accept_encoding='gzip, deflate')
+                    status, nbytes, seconds = download(conn, request, path)
+            except (OSError, HTTPParseError, zlib.error) as e:
+                status, nbytes, seconds = 'error: ' + str(e), 0, 0.0
+            with lock:
+                results.append((name, status, nbytes, seconds))
+                print("%-30s %-10s %12d bytes %8.1f ms" % (name, status, nbytes, seconds * 1000))
+        conn.close()
+
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(min(args.connections, len(args.documents)))]   # -c sets the pool size.
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    ok = [r for r in results if r[1] == 200]
+    total_bytes = sum(r[2] for r in ok)
+    print("%d of %d documents saved to %s, %d bytes in %.2f s (%.2f MB/s)" % (
+        len(ok), len(results), os.path.abspath(args.output_dir), total_bytes, elapsed, total_bytes / elapsed / 1e6))
+    return len(ok) == len(results)
+
+# Build a GET request; target is a path for a web server or a full URL for the proxy
+def build_request(target, host_header, keep_alive, accept_encoding=None, byte_range=None, if_range=None):
+    request = 'GET ' + target + ' HTTP/1.1\r\n'
+    request += 'Host: ' + host_header + '\r\n'
+    request += 'User-Agent: client7.0-bench\r\n'
+    request += 'Connection: ' + ('keep-alive' if keep_alive else 'close') + '\r\n'
+    if accept_encoding:
+        request += 'Accept-Encoding: ' + accept_encoding + '\r\n'
+    if byte_range:
+        request += 'Range: bytes=%d-%d\r\n' % byte_range
+        if if_range:
+            request += 'If-Range: ' + if_range + '\r\n'
+    request += '\r\n'
+    return request.encode('latin-1')
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+# Latency summary in milliseconds
+def summarize(values):
+    values = sorted(values)
+    summary = {'count': len(values)}
+    for name, p in (('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9)):
+        value = percentile(values, p)
+        summary[name] = round(value * 1000, 3) if value is not None else None
+    summary['max'] = round(values[-1] * 1000, 3) if values else None
+    summary['mean'] = round(sum(values) / len(values) * 1000, 3) if values else None
+    return summary
+
+# Drive N concurrent connections against the server (or the proxy) and report the results
+def run_benchmark(args):
+    """Closed loop by default: each connection sends its next request when the previous
+    one completes. With --rate, requests are started on a fixed schedule and the total
+    latency is measured from the scheduled time, so a slow server cannot hide its queueing
+    delay by slowing the client down (coordinated omission)."""
+    if args.url:   # Through the proxy: absolute URL in the request line, Host of the target site.
+        target, host_header = args.url, urlsplit(args.url).netloc
+    else:
+        target, host_header = args.path, args.host + ':' + str(args.port)
+    raw_request = build_request(target, host_header, args.keep_alive)
+
+    lock = threading.Lock()
+    issued = [0]
+    connect_times, ttfb_times, total_times = [], [], []
+    statuses, errors = {}, {}
+    body_bytes = [0]
+    start = time.perf_counter()
+    deadline = start + args.duration if args.duration else None
+
+    def next_request():
+        # Returns the scheduled start time (or 0 for closed loop), or None when the run is over.
+        with lock:
+            index = issued[0]
+            if args.requests and index >= args.requests:
+                return None
+            if deadline and time.perf_counter() >= deadline:
+                return None
+            issued[0] += 1
+        return start + index / args.rate if args.rate else 0
+
+    def worker():
+        conn = ClientConnection(args.host, args.port, args.timeout)
+        while True:
+            scheduled = next_request()
+            if scheduled is None:
+                break
+            if scheduled:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            begin = time.perf_counter()
+            try:
+                head, nbytes, (connect, ttfb, total) = conn.request(raw_request)
+            except (OSError, HTTPParseError) as e:
+                with lock:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                conn.close()
+                continue
+            queued = begin - scheduled if scheduled else 0.0   # Time the request waited behind its schedule.
+            with lock:
+                if connect:
+                    connect_times.append(connect)
+                ttfb_times.append(ttfb + queued)
+                total_times.append(total + queued)
+                statuses[head.status] = statuses.get(head.status, 0) + 1
+                body_bytes[0] += nbytes
+            if not args.keep_alive:
+                conn.close()
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(args.connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    completed = len(total_times)
+    result = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(time.time() - elapsed)),
+        'config': {'host': args.host, 'port': args.port, 'target': target, 'connections': args.connections,
+                   'requests': args.requests, 'duration': args.duration, 'rate': args.rate,
+                   'keep_alive': args.keep_alive},
+        'elapsed_s': round(elapsed, 3),
+        'completed': completed,
+        'errors': errors,
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'requests_per_s': round(completed / elapsed, 2) if elapsed else None,
+        'body_bytes': body_bytes[0],
+        'throughput_bytes_per_s': round(body_bytes[0] / elapsed, 1) if elapsed else None,
+        'latency_ms': {'connect': summarize(connect_times), 'ttfb': summarize(ttfb_times),
+                       'total': summarize(total_times)},
+    }
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:   # Machine-readable results for comparing builds.
+            json.dump(result, f, indent=2)
+        print("Results written to " + args.json)
+    return result
+
+# Print the benchmark results as a small table
+def print_report(result):
+    print("%d requests in %.2f s: %.1f req/s, %.2f MB/s, errors %s, status %s" % (
+        result['completed'], result['elapsed_s'], result['requests_per_s'] or 0,
+        (result['throughput_bytes_per_s'] or 0) / 1e6, result['errors'] or 0, result['statuses']))
+    print("%-8s %10s %10s %10s %10s %10s   (ms)" % ('', 'p50', 'p90', 'p99', 'p99.9', 'max'))
+    for name, summary in result['latency_ms'].items():
+        cells = ['%10s' % ('-' if summary[key] is None else '%.3f' % summary[key])
+                 for key in ('p50', 'p90', 'p99', 'p999', 'max')]
+        print("%-8s %s" % (name, ' '.join(cells)))
+
+# Command line options for the benchmark mode
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP client for WebServer and ProxyServer. "
+                                                 "Runs interactively unless --bench is given.")
+    parser.add_argument('--bench', action='store_true', help="run the non-interactive load generator")
+    parser.add_argument('--host', default='127.0.0.1', help="server or proxy address (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help="server or proxy port (default 8000)")
+    parser.add_argument('--path', default='/test1.html', help="path to request from a web server")
+    parser.add_argument('--url', help="full URL to request through the proxy at --host/--port")
+    parser.add_argument('-c', '--connections', type=int, default=10, help="concurrent connections (default 10)")
+    parser.add_argument('-n', '--requests', type=int, default=0, help="total requests (default 1000 without --duration)")
+    parser.add_argument('-d', '--duration', type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument('-k', '--keep-alive', action='store_true', help="reuse connections between requests")
+    parser.add_argument('--rate', type=float, default=0, help="fixed request rate per second (default closed loop)")
+    parser.add_argument('--timeout', type=float, default=10, help="socket timeout in seconds")
+    parser.add_argument('--json', help="write the results to this JSON file")
+    parser.add_argument('--batch', nargs='+', metavar='DOC', dest='documents', default=[],
+                        help="download these documents concurrently instead of benchmarking")
+    parser.add_argument('--batch-file', help="file with one document per line to add to the batch")
+    parser.add_argument('--output-dir', default='downloads', help="where batch downloads are saved (default downloads)")
+    parser.add_argument('--segments', type=int, default=1,
+                        help="fetch each batch document as this many parallel byte ranges (default 1)")
+    args = parser.parse_args(argv)
+    if not args.requests and not args.duration:
+        args.requests = 1000
+    return args
+
+# The original interactive client: one GET per question, the page is opened in the browser
+def interactive():
+    while True:
+        # Let the user input the server port with a default value of 8000
+        server_port = get_valid_port("Enter the server port [default:8000]: ", 8000)
+
+        # Let the user input the object filename with a default value of test1.html
+        obj = input("Hello, which document do you want to query? (default: test1.html): ")
+        if not obj:
+            obj = "test1.html"   # Set a default object filename if no input is provided.
+
+        # Build a new client connection for each request (connected when the request is sent)
+        client = ClientConnection("127.0.0.1", server_port)
+
+        # Write the GET header with additional headers similar to a browser
+        Head = 'GET /' + obj + ' HTTP/1.1\r\n'                  # Build the GET request header with the requested object.
+        Head += 'Host: 127.0.0.1:' + str(server_port) + '\r\n'  # Specify the host and port in the header.
+        # Add various HTTP headers to simulate a browser's request.
+        Head += 'Connection: close\r\n'
+        Head += 'User-Agent: Mozilla/5.0 (compatible; MyClient/0.1; +http://myclient.example.com)\r\n'
+        Head += 'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+        Head += 'Accept-Language: en-US,en;q=0.5\r\n'
+        Head += 'Accept-Encoding: gzip, deflate\r\n'   # Encodings the client can decode while saving.
+        Head += 'Upgrade-Insecure-Requests: 1\r\n'
+        Head += '\r\n'   # End of the request headers.
+
         file_name = "./recv_index.html"  # Define the path where the received file will be saved.
-        f = open(file_name, 'wb')   # Open the file for writing in binary mode.
-        for lines in write_data:
-            f.write(lines.encode())   # Write each line of the content to the file.
-            f.write("\n".encode())    # Add newline characters between lines.
-        f.close()   # Close the file.
-
-        file_path = os.path.abspath(file_name)   # Get the absolute path of the saved file.
-        print("HTML file request is stored in " + file_path)   # Print the path of the saved file.
-        webbrowser.open_new_tab(file_path)   # Open the saved HTML file in a new browser tab.
-
-    # Close the socket after receiving the response
-    client_socket.close()   # Close the client socket for this request.
+        # Send the request and stream the body straight into the file, whatever its size or content
+        try:
+            status, _, _ = download(client, Head.encode('utf-8'), file_name)
+        except (OSError, HTTPParseError, zlib.error) as e:
+            print("Error: " + str(e))   # The server could not be reached or sent a broken response.
+            continue
+        finally:
+            # Close the socket after receiving the response
+            client.close()   # Close the client socket for this request.
+
+        # Check for a 404 Not Found status in the response
+        if status == 404:
+            print("Error: File not found (404)")   # Print an error message for a 404 status.
+        elif status != 200:
+            print("Error: server answered " + str(status))
+        else:
+            file_path = os.path.abspath(file_name)   # Get the absolute path of the saved file.
+            print("HTML file request is stored in " + file_path)   # Print the path of the saved file.
+            webbrowser.open_new_tab(file_path)   # Open the saved HTML file in a new browser tab.
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.batch_file:
+        with open(args.batch_file) as f:
+            args.documents += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if args.documents:
+        sys.exit(0 if run_batch(args) else 1)
+    if args.bench:
+        result = run_benchmark(args)
+        sys.exit(1 if result['errors'] and not result['completed'] else 0)
+    interactive()
@@ -0,0 +1,124 @@
+# 代理服务器的DNS解析缓存：成功和失败的结果分别按TTL缓存，解析在线程池中进行，
+# 同一个名字的并发解析只发出一次，用getaddrinfo同时支持IPv4和IPv6。解析函数可以替换，方便用桩函数测试
+
+
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+POSITIVE_TTL = 300          # 解析成功的结果缓存时间（秒）
+NEGATIVE_TTL = 30           # 解析失败的结果缓存时间，避免不存在的域名反复拖慢请求
+MAX_ENTRIES = 4096          # 缓存的名字个数上限
+RESOLVE_WORKERS = 8         # 解析线程数
+RESOLVE_TIMEOUT = 10        # 等待一次解析的最长时间（秒）
+
+# 系统解析器。返回 (地址列表, TTL)，地址列表是getaddrinfo的结果；getaddrinfo拿不到记录的TTL，返回None表示使用默认值
+def system_resolver(host, port):
+    return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM), None
+
+class DNSCache:
+    def __init__(self, resolver=system_resolver, positive_ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL,
+                 max_entries=MAX_ENTRIES, workers=RESOLVE_WORKERS):
+        self.resolver = resolver
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dns')
+        self.lock = threading.Lock()
+        self.entries = {}       # (主机, 端口) -> (过期时间, 地址列表或(异常类型, 异常参数))
+        self.pending = {}       # (主机, 端口) -> 正在进行的解析的Future
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0      # 合并到正在进行的解析上的查询
+        self.failures = 0
+
+    # 非阻塞的解析，返回Future，结果是地址列表；解析失败时Future里是异常
+    def resolve_async(self, host, port):
+        key = (host, port)
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                if isinstance(cached[1], tuple):
+                    # 每次命中都抛一个新的异常对象：共用同一个对象时，各线程raise会不断往它的__traceback__上追加帧
+                    self.negative_hits += 1
+                    return self.completed_future(self.cached_error(*cached[1]))
+                self.hits += 1
+                return self.completed_future(cached[1])
+            future = self.pending.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            self.misses += 1
+            future = self.pending[key] = self.executor.submit(self.lookup, key)
+        return future
+
+    # 阻塞的解析，返回地址列表，失败时抛出解析时的异常（通常是socket.gaierror）
+    def resolve(self, host, port, timeout=RESOLVE_TIMEOUT):
+        return self.resolve_async(host, port).result(timeout)
+
+    # 在解析线程中执行：调用解析器并把结果放进缓存。无论成功失败都要从pending中删掉，
+    # 否则之后的查询都会合并到这个已经结束的Future上
+    def lookup(self, key):
+        result, ttl = None, 0
+        try:
+            try:
+                addresses, ttl = self.resolver(*key)
+                if not addresses:
+                    raise socket.gaierror(socket.EAI_NONAME, "No address for %s" % key[0])
+                result = list(addresses)
+                ttl = self.positive_ttl if ttl is None else min(ttl, self.positive_ttl)   # 记录自带的TTL不超过上限
+            except Exception as e:
+                # 除了OSError，getaddrinfo对过长的标签会抛UnicodeError，替换的解析器也可能抛别的异常；
+                # 主机名来自客户端，这些都按解析失败做否定缓存
+                result, ttl = e, self.negative_ttl
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+                if isinstance(result, Exception):
+                    self.failures += 1
+                if result is not None and ttl > 0:
+                    if len(self.entries) >= self.max_entries:
+                        self.prune()
+                    value = (type(result), result.args) if isinstance(result, Exception) else result
+                    self.entries[key] = (time.monotonic() + ttl, value)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    # 缓存满时先删掉过期的条目，还不够就删掉最早过期的一半。调用者必须持有锁
+    def prune(self):
+        now = time.monotonic()
+        for key in [key for key, (expires, _) in self.entries.items() if expires <= now]:
+            del self.entries[key]
+        if len(self.entries) >= self.max_entries:
+            by_expiry = sorted(self.entries, key=lambda key: self.entries[key][0])
+            for key in by_expiry[:len(by_expiry) // 2]:
+                del self.entries[key]
+
+    # 由缓存的异常类型和参数重新构造异常；替换的解析器抛出的异常不一定能这样构造，这时改用gaierror
+    @staticmethod
+    def cached_error(error_type, args):
+        try:
+            return error_type(*args)
+        except Exception:
+            return socket.gaierror(socket.EAI_FAIL, "%s%r" % (error_type.__name__, args))
+
+    @staticmethod
+    def completed_future(result):
+        future = Future()
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+        return future
+
+    def invalidate(self, host, port):
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'negative_hits': self.negative_hits,
+                    'misses': self.misses, 'coalesced': self.coalesced, 'failures': self.failures}
@@ -0,0 +1,264 @@
+# 增量式HTTP报文头解析器，WebServer和ProxyServer共用
+# 直接在bytes上解析请求行和请求头，可以多次feed分段到达的数据；请求体不解码，原样留在buffer中
+
+
+from urllib.parse import urlsplit   # 解析代理请求中的绝对URL
+
+# 默认的大小限制
+MAX_LINE = 8192             # 请求行的最大长度
+MAX_HEADER_BYTES = 65536    # 整个报文头的最大长度
+MAX_HEADERS = 100           # 报文头的最大行数
+
+# 解析错误。status是应该回复给客户端的状态；继承ValueError，原来按ValueError回复400的代码不需要修改
+class HTTPParseError(ValueError):
+    def __init__(self, message, status='400 BAD REQUEST'):
+        super().__init__(message)
+        self.status = status
+
+# 报文头集合：保留原始顺序和重复的头，按名字查找时不区分大小写。值按latin-1解码（HTTP头本身就是单字节编码）
+class Headers:
+    def __init__(self, items=()):
+        self.items_list = []     # [(名字, 值), ...]，保留原始大小写
+        self.index = {}          # 小写名字 -> [值, ...]
+        for name, value in items:
+            self.add(name, value)
+
+    def add(self, name, value):
+        self.items_list.append((name, value))
+        self.index.setdefault(name.lower(), []).append(value)
+
+    def get(self, name, default=None):
+        values = self.index.get(name.lower())
+        if not values:
+            return default
+        if len(values) == 1:
+            return values[0]
+        return ', '.join(values)   # 同名的多个头按逗号合并
+
+    def get_all(self, name):
+        return list(self.index.get(name.lower(), []))
+
+    def __contains__(self, name):
+        return name.lower() in self.index
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __len__(self):
+        return len(self.items_list)
+
+    def items(self):
+        return list(self.items_list)
+
+    def __repr__(self):
+        return 'Headers(%r)' % self.items_list
+
+# 解析出的请求头
+class RequestHead:
+    def __init__(self, method, target, version, headers, raw):
+        self.method = method        # 'GET'
+        self.target = target        # '/index.html' 或代理请求中的 'http://host/path'
+        self.version = version      # 'HTTP/1.1'
+        self.headers = headers      # Headers
+        self.raw = raw              # 原始的报文头字节（不含最后的空行），用于日志
+
+    # 请求的主机和端口：优先使用绝对URL中的主机，否则使用Host头
+    def host_port(self, default_port=80):
+        if '://' in self.target:
+            parts = urlsplit(self.target)
+        else:
+            parts = urlsplit('//' + self.headers.get('host', ''))
+        return parts.hostname, parts.port or default_port   # 端口格式错误时抛出ValueError
+
+    # 请求的路径（含查询字符串）
+    def path(self):
+        if '://' in self.target:
+            parts = urlsplit(self.target)
+            return (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        return self.target
+
+    # HTTP/1.1默认保持连接，HTTP/1.0需要显式的Connection: keep-alive
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if 'close' in connection:
+            return False
+        if self.version == 'HTTP/1.1':
+            return True
+        return 'keep-alive' in connection
+
+# 增量式报文头解析器的公共部分：在缓冲区中寻找报文头结束的空行，只扫描新到达的数据
+class HeadParser:
+    def __init__(self, max_line=MAX_LINE, max_header_bytes=MAX_HEADER_BYTES, max_headers=MAX_HEADERS):
+        self.max_line = max_line
+        self.max_header_bytes = max_header_bytes
+        self.max_headers = max_headers
+        self.buffer = bytearray()   # 已收到但还没解析的字节；解析出一个报文头后，剩下的是报文体或下一个报文
+        self.scan_from = 0          # 下次从这里开始查找空行，避免每次都从头扫描
+
+    def feed(self, data):
+        self.buffer += data
+
+    # 从缓冲区取出一个完整的报文头，返回 (起始行, Headers, 原始字节)，起始行由子类按请求或响应解析。
+    # 数据还不完整时返回None，格式错误时抛出HTTPParseError
+    def next_head(self):
+        end = self.buffer.find(b'\r\n\r\n', self.scan_from)
+        if end < 0:
+            self.check_incomplete()
+            self.scan_from = max(0, len(self.buffer) - 3)   # 空行可能跨越两次到达的数据
+            return None
+        raw = bytes(self.buffer[:end])
+        del self.buffer[:end + 4]
+        self.scan_from = 0
+        if end > self.max_header_bytes:
+            raise HTTPParseError("Header too large", '431 REQUEST HEADER FIELDS TOO LARGE')
+        return self.parse(raw)
+
+    # 数据还不完整时检查大小限制，不等到收完才拒绝
+    def check_incomplete(self):
+        line_end = self.buffer.find(b'\r\n')
+        if (line_end < 0 and len(self.buffer) > self.max_line) or line_end > self.max_line:
+            raise HTTPParseError("Start line too long", '414 URI TOO LONG')
+        if len(self.buffer) > self.max_header_bytes:
+            raise HTTPParseError("Header too large", '431 REQUEST HEADER FIELDS TOO LARGE')
+
+    # 缓冲区里是否有未解析的非空白数据（连接关闭时用于判断请求是否被截断）
+    def has_partial(self):
+        return bool(self.buffer.strip())
+
+    def parse(self, raw):
+        lines = raw.split(b'\r\n')
+        start_line = lines[0]
+        if len(start_line) > self.max_line:
+            raise HTTPParseError("Start line too long", '414 URI TOO LONG')
+        if len(lines) - 1 > self.max_headers:
+            raise HTTPParseError("Too many headers", '431 REQUEST HEADER FIELDS TOO LARGE')
+        headers = Headers()
+        for line in lines[1:]:
+            name, sep, value = line.partition(b':')
+            # 名字中不能有空白；以空白开头的折行（obs-fold）已被RFC 7230废弃
+            if not sep or not name or name != name.strip() or b' ' in name or b'\t' in name:
+                raise HTTPParseError("Malformed header line")
+            headers.add(name.decode('latin-1'), value.strip().decode('latin-1'))
+        return start_line, headers, raw
+
+# 请求解析器
+class RequestParser(HeadParser):
+    def next_request(self):
+        head = self.next_head()
+        return parse_request_line(*head) if head is not None else None
+
+# 解析请求行，和已解析的头部一起组成RequestHead
+def parse_request_line(start_line, headers, raw):
+    words = start_line.split()    # GET /index.html HTTP/1.1
+    if len(words) not in (2, 3) or not words[0].isalpha():
+        raise HTTPParseError("Malformed request line")
+    method = words[0].decode('ascii')
+    target = words[1].decode('latin-1')
+    version = words[2].decode('ascii', 'replace') if len(words) == 3 else 'HTTP/1.0'   # 没有版本号的按1.0处理
+    if not version.startswith('HTTP/'):
+        raise HTTPParseError("Malformed request line")
+    return RequestHead(method, target, version, headers, raw)
+
+# 解析一个已经完整接收的请求头（不含最后的空行）
+def parse_request_head(raw, max_line=MAX_LINE, max_headers=MAX_HEADERS):
+    parser = RequestParser(max_line, len(raw) + 4, max_headers)
+    parser.feed(raw + b'\r\n\r\n')
+    return parser.next_request()
+
+# 解析出的响应头
+class ResponseHead:
+    def __init__(self, version, status, reason, headers, raw):
+        self.version = version      # 'HTTP/1.1'
+        self.status = status        # 200
+        self.reason = reason        # 'OK'
+        self.headers = headers      # Headers
+        self.raw = raw              # 原始的报文头字节（不含最后的空行）
+
+    # 源站是否允许在这个响应之后继续使用连接
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if 'close' in connection:
+            return False
+        if self.version == 'HTTP/1.1':
+            return True
+        return 'keep-alive' in connection
+
+    # 响应体的分帧方式（RFC 7230 3.3.3）：
+    # ('none', 0) 没有响应体，('length', n) 读n字节，('chunked', None) 分块编码，('close', None) 读到连接关闭
+    def framing(self, request_method='GET'):
+        if request_method == 'HEAD' or 100 <= self.status < 200 or self.status in (204, 304):
+            return 'none', 0
+        transfer_encoding = self.headers.get('transfer-encoding')
+        if transfer_encoding is not None:
+            if transfer_encoding.lower().split(',')[-1].strip() == 'chunked':
+                return 'chunked', None
+            return 'close', None
+        content_length = self.headers.get_all('content-length')
+        if content_length:
+            values = set(v.strip() for value in content_length for v in value.split(','))
+            if len(values) != 1 or not all(v.isdigit() for v in values):   # 多个不一致的长度是错误的响应
+                raise HTTPParseError("Invalid Content-Length", '502 BAD GATEWAY')
+            return 'length', int(values.pop())
+        return 'close', None
+
+# 响应解析器，代理用它解析源站的响应
+class ResponseParser(HeadParser):
+    def next_response(self):
+        head = self.next_head()
+        return parse_status_line(*head) if head is not None else None
+
+# 解析状态行，和已解析的头部一起组成ResponseHead
+def parse_status_line(start_line, headers, raw):
+    words = start_line.split(None, 2)    # HTTP/1.1 200 OK
+    if len(words) < 2 or not words[0].startswith(b'HTTP/') or not words[1].isdigit() or len(words[1]) != 3:
+        raise HTTPParseError("Malformed status line", '502 BAD GATEWAY')
+    reason = words[2].decode('latin-1') if len(words) == 3 else ''
+    return ResponseHead(words[0].decode('ascii', 'replace'), int(words[1]), reason, headers, raw)
+
+# 增量式分块编码（Transfer-Encoding: chunked）解码器。feed返回这次能解出的数据，
+# 最后一个块和trailer读完后done为True，多出来的字节（下一个报文）留在buffer中
+class ChunkedDecoder:
+    def __init__(self, max_line=MAX_LINE):
+        self.max_line = max_line
+        self.buffer = bytearray()
+        self.state = 'size'     # 'size' 块大小行，'data' 块数据，'data_end' 块后的CRLF，'trailer' 结尾的trailer
+        self.remaining = 0      # 当前块还没读的字节数
+        self.done = False
+
+    def feed(self, data):
+        self.buffer += data
+        out = bytearray()
+        while not self.done:
+            if self.state == 'data':
+                n = min(self.remaining, len(self.buffer))
+                if n == 0:
+                    break
+                out += self.buffer[:n]
+                del self.buffer[:n]
+                self.remaining -= n
+                if self.remaining == 0:
+                    self.state = 'data_end'
+                continue
+            end = self.buffer.find(b'\r\n')
+            if end < 0:
+                if len(self.buffer) > self.max_line:
+                    raise HTTPParseError("Chunk line too long")
+                break
+            line = bytes(self.buffer[:end])
+            del self.buffer[:end + 2]
+            if self.state == 'data_end':
+                if line:
+                    raise HTTPParseError("Missing CRLF after chunk data")
+                self.state = 'size'
+            elif self.state == 'size':
+                size = line.split(b';', 1)[0].strip()    # 忽略块扩展
+                if not size or any(c not in b'0123456789abcdefABCDEF' for c in size):
+                    raise HTTPParseError("Invalid chunk size")
+                self.remaining = int(size, 16)
+                self.state = 'data' if self.remaining else 'trailer'
+            elif not line:     # trailer以空行结束
+                self.done = True
+        return bytes(out)
@@ -0,0 +1,127 @@
+# Internet校验和（RFC 1071）与增量更新（RFC 1624），ICMPPing和Traceroute共用。
+# 一次把整个包当作一个大整数处理：2^16 ≡ 1 (mod 0xffff)，所以所有16位字的反码和
+# 就是这个大整数对0xffff取模，取模在C里完成，不用在Python里逐字节循环。
+# 直接运行本文件会对照逐字节的参考实现做随机性质检查，并测量不同包长下的速度。
+
+
+import os
+import sys
+import timeit
+import random
+
+
+def ones_sum(data):
+    """
+    返回data按大端16位字累加的反码和（0..0xffff），长度为奇数时末尾补一个零字节。
+    """
+    if len(data) & 1:
+        data = bytes(data) + b'\0'
+    total = int.from_bytes(data, 'big')
+    folded = total % 0xffff
+    if folded == 0 and total:
+        return 0xffff   # 反码运算中非零数据的和不会是+0，对应的是-0（0xffff）
+    return folded
+
+
+def checksum(data):
+    """
+    计算data的Internet校验和，结果按网络字节序打包（struct格式'!H'）后直接放进报文头。
+    计算时报文中的校验和字段应为0。
+    """
+    return ~ones_sum(data) & 0xffff
+
+
+def update(csum, offset, old, new):
+    """
+    报文中从offset开始的一段由old改成new（长度相同）时，按RFC 1624的公式
+    HC' = ~(~HC + ~m + m') 由旧校验和算出新校验和，不用重新扫描整个报文。
+    用于模板报文只有序列号或时间戳变化的情况。
+    """
+    if len(old) != len(new):
+        raise ValueError("old and new must have the same length")
+    if offset & 1:   # 字段从奇数位置开始时，前面补一个零字节让它和16位字对齐
+        old = b'\0' + bytes(old)
+        new = b'\0' + bytes(new)
+    total = (~csum & 0xffff) + (~ones_sum(old) & 0xffff) + ones_sum(new)
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def reference_checksum(packet):
+    """
+    原来ICMPPing中逐字节循环的实现，只用于对照检查和速度比较。
+    """
+    csum = 0
+    count_to = (len(packet) // 2) * 2
+    count = 0
+    while count < count_to:
+        this_val = packet[count+1] * 256 + packet[count]
+        csum += this_val
+        csum &= 0xffffffff
+        count += 2
+    if count_to < len(packet):
+        csum += packet[len(packet) - 1]
+        csum &= 0xffffffff
+    csum = (csum >> 16) + (csum & 0xffff)
+    csum += (csum >> 16)
+    answer = ~csum & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    return answer
+
+
+def self_check(rounds=20000, seed=1):
+    """
+    随机数据上的性质检查：checksum与参考实现一致（包括奇数长度和全0、全0xff的数据），
+    带上校验和之后整个报文的校验和为0，增量更新与重新计算一致。
+    """
+    rng = random.Random(seed)
+    samples = [b'', b'\0', b'\0' * 64, b'\xff' * 63, b'\xff\xff' * 32]
+    for _ in range(rounds):
+        size = rng.choice((rng.randrange(0, 64), rng.randrange(0, 2048)))
+        samples.append(rng.getrandbits(8 * size).to_bytes(size, 'big') if size else b'')
+    for data in samples:
+        assert checksum(data) == reference_checksum(data), data
+    for _ in range(rounds):
+        # ICMP回显请求形式的报文：类型8，校验和字段在第2、3字节
+        size = 8 + rng.randrange(0, 1500)
+        packet = bytearray(os.urandom(size))
+        packet[0], packet[2:4] = 8, b'\0\0'
+        csum = checksum(packet)
+        packet[2:4] = csum.to_bytes(2, 'big')
+        assert checksum(packet) == 0
+        # 修改任意一段（可以从奇数位置开始），增量更新的结果要与重新计算的相同
+        offset = rng.randrange(4, size)
+        length = rng.randrange(0, size - offset + 1)
+        new = os.urandom(length)
+        old = bytes(packet[offset:offset + length])
+        packet[2:4] = b'\0\0'
+        packet[offset:offset + length] = new
+        assert update(csum, offset, old, new) == checksum(packet), (offset, length)
+    return len(samples)
+
+
+def benchmark(sizes=(8, 16, 64, 512, 1500, 9000, 65507)):
+    for size in sizes:
+        data = os.urandom(size)
+        number = max(10, 200000 // size)
+        fast = min(timeit.repeat(lambda: checksum(data), number=number, repeat=3)) / number
+        slow = min(timeit.repeat(lambda: reference_checksum(data), number=max(1, number // 10), repeat=3)) / max(1, number // 10)
+        print("%6d bytes: checksum %8.3f us, reference %10.3f us, %6.1fx" % (size, fast * 1e6, slow * 1e6, slow / fast))
+    # 模板报文只改序列号（偏移6）和8字节时间戳（偏移8）：增量更新的代价与报文长度无关，
+    # 小报文上整包重算反而更快，大报文上增量更新才划算
+    seq, stamp = (1).to_bytes(2, 'big'), os.urandom(8)
+    for size in (16, 1500):
+        packet = bytes(size)
+        csum = checksum(packet)
+        number = 20000
+        incremental = timeit.timeit(lambda: update(update(csum, 6, b'\0\0', seq), 8, bytes(8), stamp), number=number) / number
+        full = timeit.timeit(lambda: checksum(packet[:6] + seq + stamp + packet[16:]), number=number) / number
+        print("%6d-byte echo template: incremental update %6.3f us, rebuild + checksum %6.3f us" % (size, incremental * 1e6, full * 1e6))
+
+
+if __name__ == "__main__":
+    checked = self_check()
+    print("property check passed on %d samples" % checked)
+    if '--no-bench' not in sys.argv:
+        benchmark()
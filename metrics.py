@@ -0,0 +1,130 @@
+# 进程内的计数器、仪表和延迟直方图，按Prometheus文本格式（text/plain; version=0.0.4）输出
+
+
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# 默认的直方图桶（秒），覆盖本机缓存命中到慢源站的范围
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# 只增不减的计数器
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.value)]
+
+# 可增可减的当前值，例如活动连接数
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+# 读取时才计算的仪表，用来导出其他模块已有的当前值（缓存条目数、占用字节数等）
+class GaugeFunction:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, function):
+        self.name = name
+        self.help = help_text
+        self.function = function
+
+    def samples(self):
+        return [(self.name, self.function())]
+
+# 读取时才计算的计数器，导出其他模块里只增不减的统计（缓存淘汰数、DNS命中数等），名字应以_total结尾
+class CounterFunction(GaugeFunction):
+    kind = 'counter'
+
+# 累积直方图：每个桶统计小于等于上界的观测次数，另有总和与总次数
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)   # 每个桶自己的次数，输出时再累加
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.total += value
+            self.count += 1
+
+    def samples(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.total, self.count
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            samples.append(('%s_bucket{le="%s"}' % (self.name, format_value(bound)), cumulative))
+        samples.append(('%s_bucket{le="+Inf"}' % self.name, count))
+        samples.append((self.name + '_sum', total))
+        samples.append((self.name + '_count', count))
+        return samples
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+# 一组指标，按注册顺序输出
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self.register(Gauge(name, help_text))
+
+    def gauge_function(self, name, help_text, function):
+        return self.register(GaugeFunction(name, help_text, function))
+
+    def counter_function(self, name, help_text, function):
+        return self.register(CounterFunction(name, help_text, function))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    # Prometheus文本格式
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, value in metric.samples():
+                lines.append('%s %s' % (name, format_value(value)))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,354 @@
+# 代理服务器的磁盘缓存：内存中的索引（URL -> 条目元数据）+ 分目录存放的缓存文件
+# 按Cache-Control/Expires/Age计算新鲜度，按总字节预算做LRU淘汰，索引保存在index.json中，启动时直接加载
+
+
+import os
+import json
+import shutil                   # 304后改写条目的响应头时复制响应体
+import time
+import struct                   # 缓存条目文件的定长前缀
+import hashlib                  # URL的哈希值作为缓存文件名
+import tempfile
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime   # 解析HTTP日期（Date / Expires / Last-Modified）
+
+INDEX_FILE = "index.json"       # 索引文件名，放在缓存根目录下
+INDEX_VERSION = 2               # 条目文件格式变化时加一，旧的索引直接作废
+INDEX_SAVE_INTERVAL = 5         # 索引有变化时最多每隔这么多秒写一次磁盘
+DEFAULT_TTL = 300               # 响应没有任何新鲜度信息时的缓存时间（秒）
+HEURISTIC_FRACTION = 0.1        # 只有Last-Modified时，新鲜期取 (Date - Last-Modified) 的10%（RFC 7234 4.2.2）
+HEURISTIC_MAX_TTL = 86400       # 启发式新鲜期的上限
+CACHEABLE_STATUS = (200,)       # 只缓存完整的200响应
+
+# 条目文件格式：魔数(4字节) + 响应头长度(4字节，大端) + 响应头 + 响应体，全部是源站发来的原始字节。
+# 响应头是状态行和端到端的头（每行以CRLF结尾，不含最后的空行和Content-Length），命中时再补上长度和连接头
+ENTRY_MAGIC = b'PXC1'
+ENTRY_PREFIX = struct.Struct('!4sI')
+
+class CacheFormatError(ValueError):
+    pass
+
+# 条目文件开头的字节
+def entry_prefix(head):
+    return ENTRY_PREFIX.pack(ENTRY_MAGIC, len(head)) + head
+
+# 从条目文件开头读出响应头，返回 (响应头, 响应体的偏移量)
+def read_entry_head(f):
+    prefix = f.read(ENTRY_PREFIX.size)
+    if len(prefix) != ENTRY_PREFIX.size:
+        raise CacheFormatError("Truncated cache entry")
+    magic, head_length = ENTRY_PREFIX.unpack(prefix)
+    if magic != ENTRY_MAGIC:
+        raise CacheFormatError("Bad cache entry magic")
+    head = f.read(head_length)
+    if len(head) != head_length:
+        raise CacheFormatError("Truncated cache entry")
+    return head, ENTRY_PREFIX.size + head_length
+
+# 把HTTP日期转换成时间戳，格式错误返回None
+def http_date(value):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+# 解析Cache-Control：{'max-age': '60', 'no-cache': True, ...}，指令名转成小写
+def parse_cache_control(value):
+    directives = {}
+    for part in (value or '').split(','):
+        name, sep, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip().strip('"') if sep else True
+    return directives
+
+# 响应能否存入共享缓存
+def storable(status, headers):
+    if status not in CACHEABLE_STATUS:
+        return False
+    cc = parse_cache_control(headers.get('cache-control'))
+    return 'no-store' not in cc and 'private' not in cc
+
+# 计算响应的过期时间（时间戳）。response_time是收到响应的时间
+def expiry_time(headers, response_time, default_ttl=DEFAULT_TTL):
+    cc = parse_cache_control(headers.get('cache-control'))
+    date = http_date(headers.get('date')) or response_time
+    if 'no-cache' in cc:
+        lifetime = 0                                   # 每次使用前都必须向源站确认
+    elif 's-maxage' in cc or 'max-age' in cc:
+        value = cc.get('s-maxage', cc.get('max-age'))  # 共享缓存优先使用s-maxage
+        lifetime = int(value) if isinstance(value, str) and value.isdigit() else 0
+    elif 'expires' in headers:
+        expires = http_date(headers.get('expires'))
+        lifetime = expires - date if expires is not None else 0   # 无效的Expires视为已经过期
+    else:
+        last_modified = http_date(headers.get('last-modified'))
+        if last_modified is not None and last_modified < date:
+            lifetime = min((date - last_modified) * HEURISTIC_FRACTION, HEURISTIC_MAX_TTL)
+        else:
+            lifetime = default_ttl
+    # 响应在到达之前已经存在的时间：取Age头和Date推算出的较大值
+    age = headers.get('age', '').strip()
+    age = int(age) if age.isdigit() else 0
+    initial_age = max(age, response_time - date, 0)
+    return response_time + lifetime - initial_age
+
+# 过期后还可以先返回旧内容、同时在后台重新验证的秒数（RFC 5861 stale-while-revalidate）。
+# 响应没有指定时使用default；要求必须重新验证的响应不能返回过期内容
+def stale_while_revalidate(headers, default=0):
+    cc = parse_cache_control(headers.get('cache-control'))
+    if 'must-revalidate' in cc or 'proxy-revalidate' in cc or 'no-cache' in cc:
+        return 0
+    value = cc.get('stale-while-revalidate')
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return default
+
+# 一个缓存条目的元数据。文件内容在磁盘上，这里只保存查找、淘汰和重新验证需要的信息
+class CacheEntry:
+    FIELDS = ('url', 'path', 'size', 'stored_at', 'expires_at', 'etag', 'last_modified', 'content_type',
+              'stale_while_revalidate')
+
+    def __init__(self, url, path, size, stored_at, expires_at, etag=None, last_modified=None, content_type=None,
+                 stale_while_revalidate=0):
+        self.url = url
+        self.path = path                  # 相对于缓存根目录的路径
+        self.size = size                  # 条目文件的大小（含前缀和响应头）
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.stale_while_revalidate = stale_while_revalidate
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    # 已经过期，但还在stale-while-revalidate窗口内
+    def can_serve_stale(self, now=None):
+        return (now or time.time()) < self.expires_at + self.stale_while_revalidate
+
+    # 能否向源站做条件请求
+    def has_validators(self):
+        return bool(self.etag or self.last_modified)
+
+    def to_json(self):
+        return [getattr(self, name) for name in self.FIELDS]
+
+    @classmethod
+    def from_json(cls, values):
+        return cls(*values)
+
+# 磁盘缓存。线程安全，多个处理线程共享一个实例
+class ProxyCache:
+    def __init__(self, root, max_bytes, default_ttl=DEFAULT_TTL, default_swr=0):
+        self.root = root
+        self.max_bytes = max_bytes          # 所有缓存文件的总字节预算
+        self.default_ttl = default_ttl
+        self.default_swr = default_swr      # 响应没有指定stale-while-revalidate时使用的窗口
+        self.entries = OrderedDict()        # URL -> CacheEntry，越靠后越新
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.dirty = False                  # 索引有没保存的修改
+        self.last_save = 0
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+        self.temp_dir = os.path.join(root, "tmp")   # 正在写入的条目，和正式文件在同一个文件系统上，可以原子改名
+        os.makedirs(self.temp_dir, exist_ok=True)
+        for name in os.listdir(self.temp_dir):      # 上次退出时没写完的临时文件
+            self.discard_temp(os.path.join(self.temp_dir, name))
+        self.load_index()
+
+    # URL对应的缓存文件：sha1的前两级各两个字符作为子目录，避免单个目录里文件太多
+    @staticmethod
+    def path_for(url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    def full_path(self, entry):
+        return os.path.join(self.root, entry.path)
+
+    # 启动时加载索引，文件已经不存在的条目丢弃。不扫描缓存目录，条目很多时也能很快启动
+    def load_index(self):
+        try:
+            with open(os.path.join(self.root, INDEX_FILE), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return                          # 没有索引或索引损坏，从空缓存开始
+        if data.get('version') != INDEX_VERSION:
+            return
+        for values in data.get('entries', []):
+            entry = CacheEntry.from_json(values)
+            if os.path.exists(self.full_path(entry)):
+                self.entries[entry.url] = entry
+                self.current_bytes += entry.size
+        self.evict()
+
+    # 把索引写到磁盘。先写临时文件再改名，进程中途退出也不会留下写了一半的索引
+    def save_index(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {'version': INDEX_VERSION, 'entries': [entry.to_json() for entry in self.entries.values()]}
+            self.dirty = False
+            self.last_save = time.monotonic()
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir, suffix='.index')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, os.path.join(self.root, INDEX_FILE))
+
+    # 索引有修改并且距上次保存超过间隔时保存
+    def maybe_save_index(self):
+        if self.dirty and time.monotonic() - self.last_save > INDEX_SAVE_INTERVAL:
+            self.save_index()
+
+    # 查找条目并打开它的文件，返回 (条目, 文件) 或 None。过期的条目也会返回，由调用者决定怎么处理。
+    # count=False用于同一个请求内的重复检查，不计入命中统计
+    def open(self, url, count=True):
+        with self.lock:
+            entry = self.entries.get(url)
+            f = None
+            if entry is not None:
+                try:
+                    f = open(self.full_path(entry), 'rb')   # 打开后即使条目被淘汰、文件被删除，也能继续读
+                except FileNotFoundError:
+                    self.remove(url)
+            if f is None:
+                self.misses += count
+                return None
+            self.entries.move_to_end(url)       # 标记为最近使用
+            if entry.is_fresh():
+                self.hits += count
+            else:
+                self.stale += count
+        return entry, f
+
+    # 新建一个临时文件用于写入条目，返回 (文件, 临时路径)
+    def create_temp(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        return os.fdopen(fd, 'wb'), temp_path
+
+    def discard_temp(self, temp_path):
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+    # 把写好的临时文件作为url的条目提交。headers是源站响应头，response_time是收到响应的时间
+    def commit(self, url, temp_path, size, headers, response_time):
+        if size > self.max_bytes:
+            self.discard_temp(temp_path)
+            return None
+        entry = CacheEntry(url, self.path_for(url), size, response_time,
+                           expiry_time(headers, response_time, self.default_ttl),
+                           headers.get('etag'), headers.get('last-modified'), headers.get('content-type'),
+                           stale_while_revalidate(headers, self.default_swr))
+        path = self.full_path(entry)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            os.replace(temp_path, path)         # 原子替换，正在读旧文件的线程不受影响
+            old = self.entries.pop(url, None)
+            if old is not None:
+                self.current_bytes -= old.size
+            self.entries[url] = entry
+            self.current_bytes += size
+            self.dirty = True
+            self.evict()
+        self.maybe_save_index()
+        return entry
+
+    # 一次性存入完整的响应。head是entry_prefix格式要求的响应头字节
+    def store(self, url, head, body, headers, response_time=None):
+        f, temp_path = self.create_temp()
+        with f:
+            prefix = entry_prefix(head)
+            f.write(prefix)
+            f.write(body)
+        return self.commit(url, temp_path, len(prefix) + len(body), headers, response_time or time.time())
+
+    # 源站对条件请求回复304后更新条目。headers是存储的响应头合并304响应头后的结果，
+    # head是按它重新生成的响应头字节：RFC 7234 4.3.4要求用304中的头更新存储的响应，
+    # 否则之后的命中仍然带着旧的Date、Cache-Control和ETag，下游缓存会把它们当成已经过期。
+    # 响应体没有变化，复制到新文件后和新的响应头一起原子替换旧文件
+    def refresh(self, url, headers, response_time, head=None):
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry is None:
+            return None
+        if head is not None and not self.rewrite_head(entry, head):
+            return None
+        with self.lock:
+            if self.entries.get(url) is not entry:
+                return None                 # 期间条目被替换或淘汰了
+            entry.stored_at = response_time
+            entry.expires_at = expiry_time(headers, response_time, self.default_ttl)
+            entry.stale_while_revalidate = stale_while_revalidate(headers, self.default_swr)
+            entry.etag = headers.get('etag') or entry.etag
+            entry.last_modified = headers.get('last-modified') or entry.last_modified
+            self.revalidations += 1
+            self.dirty = True
+        self.maybe_save_index()
+        return entry
+
+    # 把条目文件换成新的响应头加原来的响应体。条目在复制期间被替换或删除时放弃，返回False
+    def rewrite_head(self, entry, head):
+        path = self.full_path(entry)
+        f, temp_path = self.create_temp()
+        try:
+            with f, open(path, 'rb') as old:
+                _, body_offset = read_entry_head(old)
+                prefix = entry_prefix(head)
+                f.write(prefix)
+                shutil.copyfileobj(old, f, 1024 * 1024)
+                size = f.tell()
+        except (OSError, CacheFormatError):
+            self.discard_temp(temp_path)
+            with self.lock:
+                if self.entries.get(entry.url) is entry:
+                    self.remove(entry.url)  # 文件丢失或损坏，条目作废
+            return False
+        with self.lock:
+            if self.entries.get(entry.url) is not entry:
+                self.discard_temp(temp_path)
+                return False
+            os.replace(temp_path, path)     # 正在用旧文件发送的线程不受影响
+            self.current_bytes += size - entry.size
+            entry.size = size
+            self.dirty = True
+            self.evict()
+        return True
+
+    # 超出预算时淘汰最久未使用的条目。调用者必须持有锁
+    def evict(self):
+        while self.current_bytes > self.max_bytes and self.entries:
+            url = next(iter(self.entries))
+            self.remove(url)
+            self.evictions += 1
+
+    # 删除条目和它的文件。调用者必须持有锁
+    def remove(self, url):
+        entry = self.entries.pop(url, None)
+        if entry is None:
+            return False
+        self.current_bytes -= entry.size
+        self.dirty = True
+        try:
+            os.unlink(self.full_path(entry))
+        except OSError:
+            pass
+        return True
+
+    def invalidate(self, url):
+        with self.lock:
+            self.remove(url)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.current_bytes, 'hits': self.hits,
+                    'stale': self.stale, 'misses': self.misses, 'evictions': self.evictions,
+                    'revalidations': self.revalidations}